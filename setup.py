@@ -115,6 +115,7 @@ setup(
     ],
     extras_require={
         'testing': ['pytest'],
+        'xlsx': ['xlsxwriter'],
     },
 
     # Scripts
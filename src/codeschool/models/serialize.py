@@ -152,8 +152,9 @@ class SerializationMixin:
             if self not in together:
                 together.append(self)
             out = []
-            for item in together:
-                item = item.specific
+            from codeschool.models.wagtail import specific_pages
+
+            for item in specific_pages(together):
                 try:
                     serializer = item._dump_python
 
@@ -1,5 +1,6 @@
 from markdown import markdown
 from django.db import models, transaction
+from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext_lazy as _
 from django.utils.text import slugify
 from wagtail.wagtailcore.models import Page
@@ -353,10 +354,37 @@ class RootList(CodeschoolPageMixin, Page):
 
     def get_context(self, request, *args, **kwargs):
         context = super().get_context(self, request, *args, **kwargs)
-        context['object_list'] = (x.specific for x in self.get_children())
+        context['object_list'] = specific_pages(self.get_children())
         return context
 
 
+def specific_pages(pages):
+    """
+    Return a list with the specific instances of the given pages, preserving
+    their order.
+
+    ``pages`` can be a queryset or a sequence of Page instances. Pages are
+    fetched with a single query per content type, instead of one query per
+    page as in ``[page.specific for page in pages]``.
+    """
+
+    if isinstance(pages, models.QuerySet):
+        pairs = list(pages.values_list('id', 'content_type_id'))
+    else:
+        pairs = [(page.id, page.content_type_id) for page in pages]
+
+    by_content_type = {}
+    for pk, content_type_id in pairs:
+        by_content_type.setdefault(content_type_id, []).append(pk)
+
+    specific = {}
+    for content_type_id, ids in by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        queryset = (model or Page)._default_manager.filter(id__in=ids)
+        specific.update((page.id, page) for page in queryset)
+    return [specific[pk] for pk, _ in pairs if pk in specific]
+
+
 BASE_CLASSES_BLACKLIST = {
     RootList, DescribablePage, ShortDescribablePage, CodeschoolPage,
     CodeschoolPageMixin, PageSerializationMixin, CodeschoolProxyPage
@@ -0,0 +1,118 @@
+#
+# Keyset (cursor based) pagination.
+#
+# Pages are ordered by (-created, -id) and each page starts just after the last
+# object of the previous page. Contrary to OFFSET pagination, the cost of
+# fetching a page does not grow with the number of pages before it.
+#
+import base64
+import binascii
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+__all__ = ['KeysetPage', 'keyset_paginate', 'paginate_request',
+           'DEFAULT_PAGE_SIZE', 'MAX_PAGE_SIZE']
+
+
+class KeysetPage:
+    """
+    A page of objects returned by keyset_paginate().
+
+    Attributes:
+        object_list:
+            List of objects in the page.
+        next_cursor:
+            Cursor for the next page or None if this is the last page.
+    """
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    has_next = property(lambda x: x.next_cursor is not None)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def encode_cursor(obj):
+    """
+    Return an opaque cursor string pointing just after the given object.
+    """
+
+    data = '%s|%s' % (obj.created.isoformat(), obj.pk)
+    return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Return a (created, id) tuple from a cursor string.
+
+    Raises ValueError if the cursor is invalid.
+    """
+
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        created, pk = data.split('|')
+        created = parse_datetime(created)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('invalid cursor: %r' % cursor)
+    if created is None:
+        raise ValueError('invalid cursor: %r' % cursor)
+    return created, pk
+
+
+def keyset_paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return a KeysetPage with the objects in queryset that come after the given
+    cursor.
+
+    Objects are ordered from newest to oldest using the (created, id) pair.
+    The model must have a "created" field. Page size is clipped to
+    MAX_PAGE_SIZE.
+    """
+
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    queryset = queryset.order_by('-created', '-id')
+    if cursor:
+        created, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk)
+        )
+
+    # We fetch one extra object to know if there is a next page
+    object_list = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(object_list) > page_size:
+        object_list = object_list[:page_size]
+        next_cursor = encode_cursor(object_list[-1])
+    return KeysetPage(object_list, next_cursor)
+
+
+def paginate_request(request, queryset, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Paginate queryset using the "cursor" and "page_size" GET parameters of the
+    request.
+
+    Invalid parameters are ignored and the first page is returned.
+    """
+
+    cursor = request.GET.get('cursor')
+    try:
+        page_size = int(request.GET.get('page_size', page_size))
+    except ValueError:
+        pass
+    try:
+        return keyset_paginate(queryset, cursor, page_size)
+    except ValueError:
+        return keyset_paginate(queryset, None, page_size)
@@ -1,5 +1,42 @@
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
-from rest_framework import routers, viewsets, serializers
+from rest_framework import routers, viewsets, serializers, pagination
+from codeschool.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+
+#
+# Pagination
+#
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Cursor based pagination ordered from the newest to the oldest object.
+    """
+
+    ordering = ('-created', '-id')
+    page_size = DEFAULT_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class IdKeysetPagination(KeysetPagination):
+    """
+    Like KeysetPagination, but for models without a "created" field.
+    """
+
+    ordering = ('-id',)
+
+
+def get_pagination_class(model):
+    """
+    Return the keyset pagination class suitable for the given model.
+    """
+
+    try:
+        model._meta.get_field('created')
+    except FieldDoesNotExist:
+        return IdKeysetPagination
+    return KeysetPagination
+
 
 #
 # REST framework
@@ -27,6 +64,7 @@ def rest_register(name, model=None):
         class ModelViewSet(viewsets.ViewSet):
             queryset = _model.objects.all()
             serializer_class = ModelSerializer
+            pagination_class = get_pagination_class(_model)
 
         router.register(name, ModelViewSet)
 
@@ -37,6 +75,7 @@ def rest_register(name, model=None):
         class ModelViewSet(viewsets.ModelViewSet):
             queryset = model._meta.model.objects.all()
             serializer_class = model
+            pagination_class = get_pagination_class(model._meta.model)
 
         router.register(name, ModelViewSet)
 
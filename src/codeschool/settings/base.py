@@ -263,6 +263,28 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+#
+# The grading cache stores the results of the automatic grader and must be
+# shared by all workers. Use memcached in larger installations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'grading': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(SOURCE_FOLDER_DIR, 'cache', 'grading'),
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
 
@@ -12,3 +12,10 @@ CODESCHOOL_BAD_USERNAME_MESSAGE = 'Sua matrícula deve ser da forma XX/XXXXXXXX'
 # SECURITY
 CODESCHOOL_USE_SANDBOX = False
 
+
+
+# GRADING
+
+#: Name of the cache (in the CACHES setting) that stores grading results of
+#: questions with deterministic answer keys. Set to None to disable it.
+CODESCHOOL_GRADING_CACHE = 'grading'
@@ -2,6 +2,9 @@
 Functions and fixtures that aids writing unit tests.
 """
 
+import os
+import time
+from contextlib import contextmanager
 import pytest
 import pytest_selenium as _
 from sulfur import Driver as _sulfur_driver
@@ -13,6 +16,46 @@ from codeschool import factories as factory
 # Useful export names
 fake = factory.fake
 
+# Multiplies all time budgets. Slow CI machines may set the
+# CODESCHOOL_TIME_BUDGET_SCALE environment variable to a value greater than 1.
+TIME_BUDGET_SCALE = float(os.environ.get('CODESCHOOL_TIME_BUDGET_SCALE', 1))
+
+
+@contextmanager
+def query_budget(max_queries, max_seconds=None):
+    """
+    Context manager that fails if the enclosed block executes more than
+    max_queries database queries or takes longer than max_seconds.
+
+    Example::
+
+        with query_budget(10, 0.5):
+            client.get(url)
+    """
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    queries = CaptureQueriesContext(connection)
+    start = time.perf_counter()
+    with queries:
+        yield queries
+    elapsed = time.perf_counter() - start
+
+    num_queries = len(queries.captured_queries)
+    if num_queries > max_queries:
+        sql = '\n'.join('    ' + q['sql'] for q in queries.captured_queries)
+        raise AssertionError(
+            '%s queries executed, but the budget is %s:\n%s'
+            % (num_queries, max_queries, sql)
+        )
+    if max_seconds is not None:
+        max_seconds *= TIME_BUDGET_SCALE
+        if elapsed > max_seconds:
+            raise AssertionError(
+                'took %.3fs, but the budget is %.3fs' % (elapsed, max_seconds)
+            )
+
 
 # Define some fixtures
 @pytest.fixture
@@ -8,6 +8,7 @@ from cs_core.models import ProgrammingLanguage
 from .models import BattleResponse, Battle
 from datetime import datetime
 from viewpack import CRUDViewPack
+from codeschool.pagination import paginate_request
 from django.views.generic.edit import ModelFormMixin
 
 from .forms import  BattleForm
@@ -45,8 +46,11 @@ def battle(request,battle_pk):
 def battle_user(request):
     """Define the battles of a user"""
     user = request.user
-    battles = BattleResponse.objects.filter(user_id=user.id)
-    context = {"battles": battles}
+    battles = BattleResponse.objects\
+        .filter(response__user_id=user.id)\
+        .select_related('battle__question')
+    page = paginate_request(request, battles)
+    context = {"battles": page, "page": page}
     return render(request, 'battles/battle_user.jinja2', context)
 
 
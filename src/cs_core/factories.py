@@ -55,16 +55,19 @@ class CourseFactory(factory.DjangoModelFactory):
         model = models.Course
 
     discipline = factory.SubFactory(DisciplineFactory)
-    teacher = factory.SubFactory(UserFactory)
-    is_active = True
+    live = True
+
+    @factory.post_generation
+    def teachers(self, create, extracted, **kwargs):
+        if create:
+            self.teachers.add(*(extracted or [UserFactory.create()]))
 
     @factory.post_generation
     def num_students(self, create, extracted, **kwargs):
         if create and extracted:
             num_students = extracted
-            for _ in range(num_students):
-                user = UserFactory.create()
-                self.register_student(user)
+            students = [UserFactory.create() for _ in range(num_students)]
+            self.register_students(students)
 
 
 class UserWithCourseFactory(UserFactory):
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from cs_core.models import Course, GradeMatrixCell
+
+
+class Command(BaseCommand):
+    help = 'rebuild the materialized grade matrix of courses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', '-c', type=int, action='append',
+                            help='only rebuild the course with the given id '
+                                 '(can be repeated).')
+
+    def handle(self, *args, course=None, **options):
+        courses = Course.objects.all()
+        if course:
+            courses = courses.filter(id__in=course)
+        for obj in courses:
+            size = GradeMatrixCell.rebuild(obj)
+            print('Rebuilt %s: %s cells.' % (obj.title, size))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from cs_core.models import Response
+
+
+class Command(BaseCommand):
+    help = 'recompute the final grades of all responses from their items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activity', '-a', type=int, action='append',
+                            help='only responses for the activity with the '
+                                 'given id (can be repeated).')
+
+    def handle(self, *args, activity=None, **options):
+        queryset = Response.objects.all()
+        if activity:
+            queryset = queryset.filter(activity_id__in=activity)
+        total = queryset.count()
+        updated = Response.update_all(queryset)
+        print('Checked %s responses, updated %s final grades.' %
+              (total, updated))
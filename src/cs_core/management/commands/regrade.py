@@ -0,0 +1,211 @@
+import copy
+import json
+import multiprocessing
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from wagtail.wagtailcore.models import Page
+from cs_core.models import Activity, Course, Response, ResponseItem, \
+    GradeMatrixCell, get_course_id
+
+METHODS = ['update', 'best', 'worst', 'best-feedback', 'worst-feedback']
+FIELDS = ['status', 'feedback_data', 'given_grade', 'final_grade']
+
+
+def regrade_items(ids, method):
+    """
+    Regrade the response items with the given ids and return a list of
+    (id, response_id, values) tuples for the items that changed.
+
+    This function runs in the worker processes and never writes to the
+    database.
+    """
+
+    result = []
+    for item in ResponseItem.objects.filter(id__in=ids):
+        old = {field: copy.deepcopy(getattr(item, field)) for field in FIELDS}
+        try:
+            item.regrade(method, commit=False, silent=True)
+        except item.InvalidResponseError:
+            continue
+        new = {field: getattr(item, field) for field in FIELDS}
+        if new != old:
+            result.append((item.id, item.response_id, new))
+    return result
+
+
+def close_connections():
+    """
+    Close all database connections.
+
+    Connections must not be shared between the main process and the workers.
+    """
+
+    for connection in connections.all():
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'regrade all response items of activities or courses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activity', '-a', type=int, action='append',
+                            default=[],
+                            help='regrade the activity with the given id (can '
+                                 'be repeated).')
+        parser.add_argument('--course', '-c', type=int, action='append',
+                            default=[],
+                            help='regrade all activities in the course with '
+                                 'the given id (can be repeated).')
+        parser.add_argument('--method', '-m', choices=METHODS,
+                            default='update',
+                            help='how new grades replace the old ones (see '
+                                 'ResponseItem.regrade).')
+        parser.add_argument('--pending', action='store_true',
+                            help='only regrade pending items (e.g., items '
+                                 'marked after an answer key changed).')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='number of items fetched from the database '
+                                 'and committed at once.')
+        parser.add_argument('--workers', '-j', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='number of grading processes.')
+        parser.add_argument('--checkpoint', default='regrade.checkpoint',
+                            help='file that stores the progress of the run.')
+        parser.add_argument('--resume', action='store_true',
+                            help='resume an interrupted run from the '
+                                 'checkpoint file.')
+
+    def handle(self, *args, activity, course, method, pending, chunk_size,
+               workers, checkpoint, resume, **options):
+        if not (activity or course):
+            raise CommandError('at least one activity or course is required.')
+
+        activity_ids = set(activity)
+        for course_obj in Course.objects.filter(id__in=course):
+            pages = course_obj.get_descendants()
+            activity_ids.update(pages.values_list('id', flat=True))
+        activity_ids = sorted(activity_ids)
+
+        # Progress is saved after each committed chunk. The checkpoint is only
+        # valid for a run with the same selection of items and method.
+        run = {'activities': activity_ids, 'method': method,
+               'pending': pending}
+        state = {'run': run, 'last_id': 0, 'processed': 0, 'updated': 0}
+        if resume:
+            try:
+                with open(checkpoint) as fd:
+                    saved = json.load(fd)
+            except FileNotFoundError:
+                raise CommandError('checkpoint not found: %s' % checkpoint)
+            if saved['run'] != run:
+                raise CommandError('checkpoint belongs to a different run.')
+            state = saved
+            print('Resuming after item %s.' % state['last_id'])
+
+        items = ResponseItem.objects\
+            .filter(response__activity_id__in=activity_ids)\
+            .order_by('id')\
+            .values_list('id', flat=True)
+        if pending:
+            items = items.filter(status=ResponseItem.STATUS_PENDING)
+
+        # Activities prepare anything that requires database writes (e.g.,
+        # answer keys) before the workers start, so workers only read
+        for page in Page.objects.filter(id__in=activity_ids):
+            page = page.specific
+            if isinstance(page, Activity):
+                page.prepare_regrade()
+
+        pool = None
+        if workers > 1:
+            close_connections()
+            pool = multiprocessing.Pool(workers)
+        start = time.time()
+        processed = 0
+        try:
+            while True:
+                ids = list(items.filter(id__gt=state['last_id'])[:chunk_size])
+                if not ids:
+                    break
+                changed = self.regrade_chunk(ids, method, pool, workers)
+                self.save_chunk(changed)
+
+                processed += len(ids)
+                state['last_id'] = ids[-1]
+                state['processed'] += len(ids)
+                state['updated'] += len(changed)
+                self.save_checkpoint(checkpoint, state)
+
+                rate = processed / max(time.time() - start, 1e-6)
+                print('%s items processed, %s updated (%.1f items/s).' %
+                      (state['processed'], state['updated'], rate))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.update_aggregates(activity_ids)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        print('Done: %s items processed, %s updated in %.1fs.' %
+              (state['processed'], state['updated'], time.time() - start))
+
+    def regrade_chunk(self, ids, method, pool, workers):
+        """
+        Regrade items with the given ids and return the list of changes.
+        """
+
+        if pool is None:
+            return regrade_items(ids, method)
+        size = max(1, -(-len(ids) // workers))
+        parts = [ids[i:i + size] for i in range(0, len(ids), size)]
+        results = pool.starmap(regrade_items, [(ids, method) for ids in parts])
+        return [change for result in results for change in result]
+
+    def save_chunk(self, changed):
+        """
+        Write changes to the database and update the final grades of the
+        affected responses in a single transaction.
+
+        Items that received identical values are updated together with a
+        single UPDATE query.
+        """
+
+        if not changed:
+            return
+        groups = {}
+        for pk, response_id, values in changed:
+            key = json.dumps(values, sort_keys=True, default=str)
+            groups.setdefault(key, (values, []))[1].append(pk)
+
+        with transaction.atomic():
+            for values, pks in groups.values():
+                ResponseItem.objects.filter(pk__in=pks).update(**values)
+            response_ids = {response_id for _, response_id, _ in changed}
+            Response.update_all(Response.objects.filter(id__in=response_ids))
+
+    def save_checkpoint(self, path, state):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(state, fd)
+        os.replace(tmp_path, path)
+
+    def update_aggregates(self, activity_ids):
+        """
+        Refresh cached statistics and grade matrices that depend on the
+        regraded activities.
+        """
+
+        contexts = Response.objects\
+            .filter(activity_id__in=activity_ids)\
+            .values_list('activity_id', 'context_id')\
+            .distinct()
+        for activity_id, context_id in contexts:
+            Activity.clear_statistics_cache(activity_id, context_id)
+
+        course_ids = {get_course_id(pk) for pk in activity_ids}
+        course_ids.discard(None)
+        for course in Course.objects.filter(id__in=course_ids):
+            GradeMatrixCell.rebuild(course)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cs_core', '0011_gradematrixcell'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='responseitem',
+            index_together=set([('response', 'response_hash')]),
+        ),
+    ]
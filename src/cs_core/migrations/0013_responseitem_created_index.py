@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cs_core', '0012_responseitem_recycle_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='responseitem',
+            index_together=set([('response', 'response_hash'),
+                                ('response', 'created', 'id')]),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import decimal
 from django.apps import apps
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ObjectDoesNotExist
@@ -10,6 +11,12 @@ import cs_core.blocks
 from . import GradingMethod
 
 ZERO = decimal.Decimal(0)
+
+#: Number of buckets in the histogram returned by Activity.get_statistics()
+STATS_HISTOGRAM_BUCKETS = 10
+
+#: Time (in seconds) that activity statistics are kept in the cache
+STATS_CACHE_TIMEOUT = 24 * 60 * 60
 RESOURCE_BLOCKS = [
     ('paragraph', blocks.RichTextBlock()),
     ('image', blocks.ImageChooserBlock()),
@@ -31,19 +38,30 @@ RESOURCE_BLOCKS = [
 ]
 
 
+def statistics_cache_key(activity_id, context_id):
+    """
+    Return the cache key for the statistics of the given activity/context.
+    """
+
+    return 'cs_core.activity-stats:%s:%s' % (activity_id, context_id)
+
+
 class ActivityQueryset(models.PageQuerySet):
     def auth(self, user, role=None):
         """
         Filter only activities that the user can see.
         """
 
-        # Filter by course
-        courses = Course.objects.auth(user, role)
-        course_ids = courses.values_list('id', flat=True)
-        qs = self.filter(course__in=course_ids)
+        from cs_core.models.course.roles import get_user_roles
 
-        # Filter by explicit student association
-        return qs.distinct()
+        # Activities are descendants of the courses they belong to
+        paths = get_user_roles(user).course_paths(role).values()
+        if not paths:
+            return self.none()
+        query = models.Q()
+        for path in paths:
+            query |= models.Q(path__startswith=path)
+        return self.filter(query)
 
 
 # noinspection SpellCheckingInspection,PyPep8Naming
@@ -236,7 +254,7 @@ class Activity(models.CopyMixin,
                                user=None,
                                context=None,
                                autograde=False,
-                               recycle=False,
+                               recycle=True,
                                _kwargs=None):
         """
         Create a new response item object for the given question and saves it on
@@ -252,10 +270,11 @@ class Activity(models.CopyMixin,
                 If true, calls the autograde() method in the response to
                 give the automatic gradings.
             recycle:
-                If true, recycle response items with the same content as the
-                submission. It checks if a different submission exists with the
-                same response_data attribute. If so, it returns this submission
-                instead of saving a new one in the database.
+                If true (default), recycle response items with the same content
+                as the submission. It checks if the user already submitted a
+                response item with the same response_data in the same context.
+                If so, it returns this item instead of saving a new one in the
+                database.
             _kwargs:
                 Additional arguments that should be passed to the
                 response item constructor. This should only be used by
@@ -275,16 +294,13 @@ class Activity(models.CopyMixin,
         response_hash = response_item_class.get_response_hash(response_data)
         response = None
         recycled = False
-        if recycle:
-            recyclable = response_item_class.objects.filter(
-                activity=self,
-                context=context,
-                response_hash=response_hash,
+        if recycle and response_hash:
+            response = response_item_class.get_recyclable(
+                user, self, context, response_hash
             )
-            for pk, value in recyclable.values_list('id', 'response_data'):
-                if value == response_data:
-                    response = recyclable.get(pk=pk)
-                    recycled = True
+            if response and response.response_data != response_data:
+                response = None  # hash collision
+            recycled = response is not None
 
         # Proceed if no response was created
         if response is None:
@@ -320,6 +336,16 @@ class Activity(models.CopyMixin,
         after the response is created.
         """
 
+    def prepare_regrade(self):
+        """
+        Prepare the activity before its response items are regraded.
+
+        The regrade command calls this method before starting the grading
+        workers, which never write to the database. Subclasses should compute
+        and store anything that grading requires here. The default
+        implementation does nothing.
+        """
+
     def has_response(self, user=None, context=None):
         """
         Return True if the user has responded to the activity.
@@ -460,25 +486,125 @@ class Activity(models.CopyMixin,
 
         return queryset
 
-    def _stats(self, attr, context, by_item=False):
-        if by_item:
-            items = self.response_items(context, self.STATUS_DONE)
-            values_list = items.values_list(attr, flat=True)
-            return Statistics(attr, values_list)
+    def get_statistics(self, context=None):
+        """
+        Return a dictionary with statistics about the grades of all responses
+        for the given context.
+
+        Statistics are computed using database aggregates and are cached until
+        a response item in the same context is graded. Pass context='any' to
+        consider all contexts.
+
+        Keys:
+            responses, response_items, correct:
+                Number of responses, graded response items and correct
+                response items.
+            best_final_grade, best_given_grade:
+                Best grades given to responses and response items.
+            mean_final_grade, median_final_grade:
+                Mean and median of the final grades of all responses.
+            mean_item_final_grade, mean_item_given_grade:
+                Mean grades of all graded response items.
+            histogram:
+                A list with the number of responses whose final grades fall
+                in each of the STATS_HISTOGRAM_BUCKETS intervals of equal
+                size between 0 and 100.
+        """
+
+        if context != 'any':
+            context = context or self.context
+        key = statistics_cache_key(self.id, getattr(context, 'id', context))
+        stats = cache.get(key)
+        if stats is None:
+            stats = self.get_statistics_compute(context)
+            cache.set(key, stats, STATS_CACHE_TIMEOUT)
+        return stats
+
+    def get_statistics_compute(self, context):
+        """
+        Compute the statistics dictionary for get_statistics().
+        """
+
+        ResponseItem = apps.get_model('cs_core', 'ResponseItem')
+
+        def count_if(**kwargs):
+            return models.Sum(models.Case(
+                models.When(then=1, **kwargs),
+                default=0,
+                output_field=models.IntegerField(),
+            ))
+
+        # Responses
+        responses = self.responses.all()
+        if context != 'any':
+            responses = responses.filter(context_id=context.id)
+        size = 100 / STATS_HISTOGRAM_BUCKETS
+        buckets = {}
+        for idx in range(STATS_HISTOGRAM_BUCKETS):
+            condition = {'final_grade__gte': idx * size}
+            if idx != STATS_HISTOGRAM_BUCKETS - 1:
+                condition['final_grade__lt'] = (idx + 1) * size
+            buckets['bucket_%s' % idx] = count_if(**condition)
+        stats = responses.aggregate(
+            responses=models.Count('id'),
+            graded=models.Count('final_grade'),
+            best_final_grade=models.Max('final_grade'),
+            mean_final_grade=models.Avg('final_grade'),
+            **buckets
+        )
+        stats['histogram'] = [
+            stats.pop('bucket_%s' % idx) or 0
+            for idx in range(STATS_HISTOGRAM_BUCKETS)
+        ]
+
+        # The median is obtained with a single query by slicing the sorted
+        # grades. Responses without a final grade are ignored, like in the
+        # other aggregates.
+        num_responses = stats.pop('graded')
+        grades = responses\
+            .filter(final_grade__isnull=False)\
+            .order_by('final_grade')\
+            .values_list('final_grade', flat=True)
+        if num_responses % 2:
+            stats['median_final_grade'] = grades[num_responses // 2]
+        elif num_responses:
+            middle = num_responses // 2
+            lo, hi = grades[middle - 1:middle + 1]
+            stats['median_final_grade'] = (lo + hi) / 2
         else:
-            if context == 'any':
-                items = self.responses.all()
-            else:
-                context = context or self.context
-                items = self.responses.all().filter(context=context)
-            return Statistics(attr, items.values_list(attr, flat=True))
+            stats['median_final_grade'] = None
+
+        # Response items
+        items = self.response_items(context, ResponseItem.STATUS_DONE)
+        stats.update(items.aggregate(
+            response_items=models.Count('id'),
+            correct=count_if(given_grade=100),
+            best_given_grade=models.Max('given_grade'),
+            mean_item_final_grade=models.Avg('final_grade'),
+            mean_item_given_grade=models.Avg('given_grade'),
+        ))
+        stats['correct'] = stats['correct'] or 0
+        return stats
+
+    @staticmethod
+    def clear_statistics_cache(activity_id, context_id):
+        """
+        Invalidate cached statistics for the given activity and context.
+
+        This is called when a response item is graded.
+        """
+
+        cache.delete_many([
+            statistics_cache_key(activity_id, context_id),
+            statistics_cache_key(activity_id, 'any'),
+        ])
 
     def best_final_grade(self, context=None):
         """
         Return the best final grade given for this activity.
         """
 
-        return self._stats('final_grade', context).max()
+        return self.get_statistics(context)['best_final_grade'] or ZERO
 
     def best_given_grade(self, context=None):
         """
@@ -486,7 +612,7 @@ class Activity(models.CopyMixin,
         penalties and bonuses.
         """
 
-        return self._stats('given_grade', context).min()
+        return self.get_statistics(context)['best_given_grade'] or ZERO
 
     def mean_final_grade(self, context=None, by_item=False):
         """
@@ -496,14 +622,21 @@ class Activity(models.CopyMixin,
         of using the responses for each student.
         """
 
-        return self._stats('final_grade', context, by_item).mean()
+        stats = self.get_statistics(context)
+        if by_item:
+            return stats['mean_item_final_grade'] or ZERO
+        return stats['mean_final_grade'] or ZERO
 
-    def mean_given_grade(self, by_item=False):
+    def mean_given_grade(self, by_item=False, context=None):
         """
         Return the average value for the given grade for this activity.
+
+        Given grades are only defined for response items, hence the average is
+        always computed over all graded response items and by_item has no
+        effect.
         """
 
-        return self._stats('given_grade', context, by_item).mean()
+        return self.get_statistics(context)['mean_item_given_grade'] or ZERO
 
     #
     # Permission control
@@ -513,19 +646,25 @@ class Activity(models.CopyMixin,
         Return True if user has permissions to edit activity.
         """
 
-        return user == self.owner or self.course.can_edit(user)
+        from cs_core.models.course.roles import get_user_roles
+
+        if user.id is not None and user.id == self.owner_id:
+            return True
+        return get_user_roles(user).can_edit_page(self)
 
     def can_view(self, user):
         """
         Return True if user has permission to view activity.
+
+        Teachers, students and staff of the course can view its activities.
         """
 
-        course = self.course
-        return (
-            self.can_edit(user) or
-            user in course.students.all() or
-            user in self.staff.all()
-        )
+        from cs_core.models.course.roles import get_user_roles
+
+        if self.can_edit(user):
+            return True
+        role = get_user_roles(user).get_page_role(self)
+        return role in ('student', 'staff')
 
     # Wagtail admin
     subpage_types = []
@@ -545,86 +684,3 @@ class Activity(models.CopyMixin,
         panels.StreamFieldPanel('resources'),
     ]
 
-
-from collections import Sequence
-from codeschool.utils import lazy
-
-
-class Statistics(Sequence):
-    """
-    An object that computes a series of statistical data over some data set.
-    """
-
-    def __init__(self, name, data, default=0):
-        self.name = name
-        self.data = list(data)
-        self.default = default
-
-    @lazy
-    def _sorted(self):
-        """
-        Cache sorted values with no given key function.
-        """
-
-        return sorted(self.data)
-
-    def __len__(self):
-        return len(self.data)
-
-    def __iter__(self):
-        return iter(self.data)
-
-    def __getitem__(self, idx):
-        return self.data[idx]
-
-    def max(self, key=lambda x: x, default=None):
-        """
-        Return the greatest value in data.
-        """
-
-        default = 0 if default is None else self.default
-        return max(self.data, key=key, default=default)
-
-    def min(self, key=lambda x: x, default=None):
-        """
-        Return the smallest value in data.
-        """
-
-        default = 0 if default is None else self.default
-        return min(self.data, key=key, default=default)
-
-    def sum(self, default=None):
-        """
-        Return the sum of all data values.
-        """
-
-        default = 0 if default is None else self.default
-        return sum(self.data, default)
-
-    def mean(self, default=None):
-        """
-        Return the mean value from data
-        """
-
-        return self.sum(default) / len(self.data)
-
-    def sorted(self, key=lambda x: x):
-        """
-        Return a list with all data values sorted by the given key function.
-        """
-
-        return self._sorted if key is None else sorted(self.data, key=key)
-
-    def median(self, key=lambda x: x):
-        """
-        Median of the data set using key function to sort values
-        """
-
-        sorted_data = self.sorted(key)
-        N = len(sorted_data)
-        if N % 2:
-            return sorted_data[N // 2]
-        elif N == 0:
-            raise ValueError('empty data set has no median')
-        else:
-            return (sorted_data[N // 2] + sorted_data[N // 2 - 1]) / 2
@@ -1,4 +1,5 @@
 import decimal
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from codeschool import models
@@ -18,8 +19,6 @@ class Response(models.CopyMixin,
         verbose_name = _('final response')
         verbose_name_plural = _('final responses')
 
-    __updated = False
-
     context = models.ForeignKey(
         'cs_core.ResponseContext',
     )
@@ -51,13 +50,6 @@ class Response(models.CopyMixin,
         """
         return self.items.count()
 
-    @classmethod
-    def from_db(cls, *args, **kwargs):
-        obj = super().from_db(*args, **kwargs)
-        obj.activity = obj.activity.specific
-        obj.update()
-        return obj
-
     @classmethod
     def get_response(cls, user, activity, context=None):
         """
@@ -87,28 +79,114 @@ class Response(models.CopyMixin,
 
     def update(self, force=False):
         """
-        Synchronize object so its state accounts for the latest responses.
+        Recompute final_grade from all response items.
+
+        The final grade is kept up to date incrementally when response items
+        are graded (see :meth:`register_grade`). This method is only necessary
+        to repair grades that were modified by other means.
+
+        The grade is saved with a single UPDATE query and only if it changes
+        or if force=True.
+        """
+
+        # TODO: in the future we should use grading_method
+        data = self.items.aggregate(grade=models.Max('final_grade'))
+        grade = data['grade'] or decimal.Decimal(0)
+        if force or grade != self.final_grade:
+            self.final_grade = grade
+            Response.objects.filter(pk=self.pk).update(final_grade=grade)
+
+    @classmethod
+    def register_grade(cls, response_id, grade):
+        """
+        Update the final grade of the response with the given id to account
+        for a new response item graded with the given grade.
+
+        The final grade is the maximum grade of all items. This is done with a
+        single atomic UPDATE query that only touches the row if the new grade
+        is greater than the current one.
+
+        Return True if the final grade was changed.
         """
-        if not self.__updated or self.final_grade is None or force:
-            # We check if any response_item was updated after the main response
-            # object. If so, we recompute the grades using the maximum grade
-            # criterium
-            # TODO: in the future we should use grading_mehod
-            changed_items = self.items.filter(modified__gte=self.modified)
-            if changed_items or True:
-                grades = self.items.values_list('final_grade', flat=True)
-                self.final_grade = max(grades, default=self.final_grade or 0)
-                self.save(update_fields=['final_grade'])
-            elif self.final_grade is None:
-                self.final_grade = 0.0
-                self.save(update_fields=['final_grade'])
-            self.__updated = True
+
+        if grade is None:
+            return False
+        qs = cls.objects.filter(
+            models.Q(final_grade__lt=grade) | models.Q(final_grade=None),
+            pk=response_id,
+        )
+        return bool(qs.update(final_grade=grade))
+
+    @classmethod
+    def update_all(cls, queryset=None, chunk_size=500):
+        """
+        Recompute the final grades of all responses in the given queryset (or
+        in the whole database).
+
+        Responses are processed in chunks of chunk_size ordered by id. Each
+        chunk uses a single aggregate query and one UPDATE query per distinct
+        grade value. Return the number of updated responses.
+        """
+
+        if queryset is None:
+            queryset = cls.objects.all()
+        queryset = queryset.order_by('id')
+
+        updated = 0
+        last_id = None
+        while True:
+            chunk = queryset
+            if last_id is not None:
+                chunk = chunk.filter(id__gt=last_id)
+            current = list(chunk.values_list('id', 'final_grade')[:chunk_size])
+            if not current:
+                break
+            last_id = current[-1][0]
+            updated += cls._update_chunk(dict(current))
+        return updated
+
+    @classmethod
+    def _update_chunk(cls, current):
+        # Update the final grades of a chunk of responses. Current is a
+        # mapping from response ids to their current final grades.
+        from cs_core.models import ResponseItem, GradeMatrixCell
+
+        items = ResponseItem.objects\
+            .filter(response_id__in=list(current))\
+            .values('response_id')\
+            .annotate(grade=models.Max('final_grade'))\
+            .order_by()
+        grades = {pk: decimal.Decimal(0) for pk in current}
+        grades.update(
+            (row['response_id'], row['grade'] or decimal.Decimal(0))
+            for row in items
+        )
+
+        # Group changed responses by grade
+        changed = {}
+        for pk, grade in grades.items():
+            if current[pk] != grade:
+                changed.setdefault(grade, []).append(pk)
+
+        # Decreased grades are not seen by the incremental grade matrix
+        decreased = [pk for pk, grade in grades.items()
+                     if current[pk] is not None and grade < current[pk]]
+
+        with transaction.atomic():
+            for grade, ids in changed.items():
+                cls.objects.filter(id__in=ids).update(final_grade=grade)
+            if decreased:
+                GradeMatrixCell.refresh(decreased)
+        return sum(len(ids) for ids in changed.values())
 
     def clean(self):
-        if not isinstance(self.activity, Activity):
+        from cs_core.models import Activity
+
+        activity = self.activity.specific
+        if not isinstance(activity, Activity):
             raise ValidationError({'activity': _('Not an activity.')})
         if self.context is None:
-            self.context = getattr(self.activity, 'default_context')
+            self.context = getattr(activity, 'default_context')
 
     def grade(self, method=None, force_update=False):
         """
@@ -118,12 +196,12 @@ class Response(models.CopyMixin,
         activity.
         """
 
-        activity = self.activity
-
         # Choose grading method
         if method is None and self.final_grade is not None:
             return self.final_grade
-        elif method is None:
+
+        activity = self.activity.specific
+        if method is None:
             grading_method = activity.grading_method
         else:
             grading_method = GradingMethod.from_name(activity.owner, method)
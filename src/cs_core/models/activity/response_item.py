@@ -1,18 +1,56 @@
 import decimal
 import json
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext_lazy as _
 from django.core.signals import Signal
 from codeschool.jinja.filters import markdown
 from codeschool import models
 from codeschool.utils import md5hash
-from cs_core.models.activity import Response
+from cs_core.models.activity import Activity, Response
 
 
 #: This signal is emitted when a response item finishes its autograde() method
 #: successfully and sets the ResponseItem status to STATUS_DONE.
 autograde_signal = Signal(providing_args=['response_item', 'given_grade'])
 
+#: Formats accepted by ResponseItem.render_feedback()
+FEEDBACK_FORMATS = ('html', 'latex', 'text')
+
+#: Time (in seconds) that rendered feedback is kept in the cache
+FEEDBACK_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def resolve_response_items(queryset):
+    """
+    Return a list with the response items in the given queryset.
+
+    Items are resolved to their concrete classes and the related response,
+    user and (specific) activity objects are fetched in batches. This takes a
+    fixed number of queries regardless of the number of items.
+    """
+
+    items = list(queryset)
+    response_ids = {item.response_id for item in items}
+    responses = Response.objects\
+        .non_polymorphic()\
+        .select_related('user')\
+        .filter(id__in=response_ids)
+    responses = {response.id: response for response in responses}
+
+    activity_ids = {response.activity_id for response in responses.values()}
+    activities = models.Page.objects.filter(id__in=activity_ids)
+    activities = {page.id: page for page in models.specific_pages(activities)}
+
+    # Fill the foreign key caches
+    response_cache = ResponseItem._meta.get_field('response').get_cache_name()
+    activity_cache = Response._meta.get_field('activity').get_cache_name()
+    for response in responses.values():
+        setattr(response, activity_cache, activities[response.activity_id])
+    for item in items:
+        setattr(item, response_cache, responses[item.response_id])
+    return items
+
 
 class ResponseItem(models.CopyMixin,
                    models.TimeStampedStatusModel,
@@ -46,6 +84,10 @@ class ResponseItem(models.CopyMixin,
     class Meta:
         verbose_name = _('response')
         verbose_name_plural = _('responses')
+        index_together = [
+            ('response', 'response_hash'),
+            ('response', 'created', 'id'),
+        ]
 
     STATUS_PENDING = 'pending'
     STATUS_INCOMPLETE = 'incomplete'
@@ -224,6 +266,7 @@ class ResponseItem(models.CopyMixin,
                     self.save()
                 raise
 
+            self.clear_feedback_cache()
             if value is None:
                 self.status = self.STATUS_WAITING
             else:
@@ -242,10 +285,32 @@ class ResponseItem(models.CopyMixin,
                                          'given_grade', 'final_grade'])
             elif commit:
                 self.save()
+            if commit and self.is_done:
+                self.update_response_grade()
+            if commit:
+                response = self.response
+                Activity.clear_statistics_cache(response.activity_id,
+                                                response.context_id)
 
         elif self.status == self.STATUS_INVALID:
             raise self.feedback_data
 
+    def update_response_grade(self):
+        """
+        Update the final grade of the parent response to account for the
+        final grade of this item.
+
+        This uses a single atomic UPDATE query and does not need to load the
+        response object.
+        """
+
+        if Response.register_grade(self.response_id, self.final_grade):
+            # Keep the cached response object in sync
+            cache_name = self._meta.get_field('response').get_cache_name()
+            response = getattr(self, cache_name, None)
+            if response is not None:
+                response.final_grade = self.final_grade
+
     def autograde_compute(self):
         """This method should be implemented in subclasses."""
 
@@ -257,7 +322,7 @@ class ResponseItem(models.CopyMixin,
             'and saved into the database.' % type(self).__name__
         )
 
-    def regrade(self, method, commit=True):
+    def regrade(self, method, commit=True, silent=False):
         """
         Recompute the grade for the given response item.
 
@@ -278,10 +343,13 @@ class ResponseItem(models.CopyMixin,
                 Like 'worst', but updates feedback_data even if the grades
                 change.
 
+        The final grade follows the new given grade unless it was manually
+        overridden. The silent argument is passed to :meth:`autograde`.
+
         Return a boolean telling if the regrading was necessary.
         """
         if self.status != self.STATUS_DONE:
-            return self.autograde()
+            return self.autograde(commit=commit, silent=silent)
 
         # We keep a copy of the state, if necessary. We only have to take some
         # action if the state changes.
@@ -290,15 +358,17 @@ class ResponseItem(models.CopyMixin,
             self.__dict__.update(state)
 
         state = self.__dict__.copy()
-        self.autograde(force=True, commit=False)
+        if not self.manual_override:
+            self.final_grade = None
+        self.autograde(force=True, commit=False, silent=silent)
 
         # Each method deals with the new state in a different manner
         if method == 'update':
             if state != self.__dict__:
                 if commit:
                     self.save()
-                return False
-            return True
+                return True
+            return False
         elif method in ('best', 'best-feedback'):
             if self.given_grade <= state.get('given_grade', 0):
                 new_feedback_data = self.feedback_data
@@ -341,6 +411,24 @@ class ResponseItem(models.CopyMixin,
             return md5hash(data)
         return ''
 
+    @classmethod
+    def get_recyclable(cls, user, activity, context, response_hash):
+        """
+        Return the latest response item submitted by the user with the given
+        response hash or None if no item is found.
+
+        This is a single query that uses the (user, activity, context) and
+        (response, response_hash) indexes.
+        """
+
+        items = cls.objects.filter(
+            response__user_id=user.id,
+            response__activity_id=activity.id,
+            response__context_id=context.id,
+            response_hash=response_hash,
+        )
+        return items.order_by('-id').first()
+
     # Feedback and visualization
     ok_message = _('*Congratulations!* Your response is correct!')
     ok_with_penalties = _('Your response is correct, but you did not achieved '
@@ -349,11 +437,54 @@ class ResponseItem(models.CopyMixin,
     partial_message = _('Your answer is partially correct: you achieved only '
                         '%(grade)d%% of the total grade.')
 
+    #: Version of the templates used to render feedback. Subclasses should
+    #: change this value whenever their templates change in order to discard
+    #: all cached feedback.
+    feedback_template_version = 1
+
     def html_feedback(self):
         """
         A string of html source representing the feedback.
         """
 
+        return self.render_feedback('html')
+
+    def render_feedback(self, format='html'):
+        """
+        Return the feedback rendered in the given format ('html', 'latex' or
+        'text').
+
+        Rendered feedback for graded items is cached outside the feedback_data
+        field and is keyed by the hash of the feedback and by the
+        feedback_template_version attribute.
+        """
+
+        if format not in FEEDBACK_FORMATS:
+            raise ValueError('invalid format: %r' % format)
+        if self.pk is None or not self.is_done:
+            return self.render_feedback_compute(format)
+
+        key = self._feedback_cache_key(format)
+        token = (self.get_feedback_hash(), self.feedback_template_version)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+
+        data = self.render_feedback_compute(format)
+        cache.set(key, (token, data), FEEDBACK_CACHE_TIMEOUT)
+        return data
+
+    def render_feedback_compute(self, format):
+        """
+        Render feedback in the given format without using the cache.
+
+        Subclasses may override this method to support specific formats.
+        """
+
+        if format != 'html':
+            raise ValueError('%s does not support %s feedback' %
+                             (type(self).__name__, format))
+
         if self.is_done:
             data = {'grade': (self.final_grade or 0)}
 
@@ -368,6 +499,28 @@ class ResponseItem(models.CopyMixin,
         else:
             return markdown(_('Your response has not been graded yet!'))
 
+    def get_feedback_hash(self):
+        """
+        Computes a hash for the feedback data and grade.
+        """
+
+        data = [self.feedback_data, self.final_grade, self.status]
+        data = json.dumps(data, sort_keys=True, default=json_default)
+        return md5hash(data)
+
+    def clear_feedback_cache(self):
+        """
+        Remove all rendered feedback for this item from the cache.
+        """
+
+        if self.pk is not None:
+            cache.delete_many(
+                [self._feedback_cache_key(fmt) for fmt in FEEDBACK_FORMATS]
+            )
+
+    def _feedback_cache_key(self, format):
+        return 'cs_core.response-item-feedback:%s:%s' % (self.pk, format)
+
     # Permissions
     def can_edit(self, user):
         return False
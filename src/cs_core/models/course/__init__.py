@@ -1,4 +1,5 @@
 from .organization import *
 from .course import *
+from .roles import *
 from .calendar import *
 from .grading import *
@@ -1,9 +1,11 @@
 from django.utils.translation import ugettext_lazy as _, ugettext as __
 from django.apps import apps
+from django.db import transaction
 from wagtail.wagtailcore.models import PageQuerySet, PageManager, Page
 from codeschool import models
 from codeschool import panels
 from codeschool.utils import delegate_to
+from cs_core.models.profile import FriendshipStatus
 
 
 class CourseQueryset(PageQuerySet):
@@ -16,15 +18,10 @@ class CourseQueryset(PageQuerySet):
         'teacher', 'student' or 'staff'.
         """
 
-        qs = self.none()
+        from cs_core.models.course.roles import get_user_roles
 
-        if role is None or role in ['student', 'can_view']:
-            qs |= user.courses_as_students.all()
-        if role is None or role in ['staff', 'can_view']:
-            qs |= user.courses_as_staff.all()
-        if role is None or role in ['teacher', 'can_edit']:
-            qs |= user.courses_as_teacher.all()
-        return qs.distinct()
+        course_ids = get_user_roles(user).course_ids(role)
+        return self.filter(id__in=course_ids)
 
 
 class Course(models.RoutablePageMixin, models.CodeschoolPage):
@@ -178,8 +175,21 @@ class Course(models.RoutablePageMixin, models.CodeschoolPage):
         Register a new student in the course.
         """
 
-        self.students.add(student)
-        self.update_friendship_status(student)
+        self.register_students([student])
+
+    def register_students(self, students):
+        """
+        Register many students in the course at once.
+
+        All missing colleague statuses between the new students and the
+        students already enrolled in the course are created in a single
+        transaction using a fixed number of queries.
+        """
+
+        students = list(students)
+        with transaction.atomic():
+            self.students.add(*students)
+            self._update_friendship_status([x.id for x in students])
 
     def update_friendship_status(self, student=None):
         """
@@ -189,25 +199,46 @@ class Course(models.RoutablePageMixin, models.CodeschoolPage):
         If no student is given, update the status of all enrolled students.
         """
 
-        update = self._update_friendship_status
-        if student is None:
-            for student in self.students.all():
-                update(student)
-        else:
-            update(student)
-
-    def _update_friendship_status(self, student):
-        # Worker function for update_friendship_status
-        colleague_status = FriendshipStatus.STATUS_COLLEAGUE
-        for colleague in self.students.all():
-            if colleague != student:
-                try:
-                    FriendshipStatus.objects.get(owner=student,
-                                                 other=colleague)
-                except FriendshipStatus.DoesNotExist:
-                    FriendshipStatus.objects.create(owner=student,
-                                                    other=colleague,
-                                                    status=colleague_status)
+        student_ids = None if student is None else [student.id]
+        with transaction.atomic():
+            self._update_friendship_status(student_ids)
+
+    def _update_friendship_status(self, student_ids=None):
+        # Worker function for update_friendship_status. It creates the
+        # colleague statuses (in both directions) between the given students
+        # and everyone enrolled in the course that do not exist yet. Existing
+        # statuses (e.g., friends) are never overridden.
+        enrolled = set(self.students.values_list('id', flat=True))
+        student_ids = enrolled if student_ids is None else set(student_ids)
+        required = set()
+        for owner in student_ids:
+            for other in enrolled:
+                if owner != other:
+                    required.add((owner, other))
+                    required.add((other, owner))
+        if not required:
+            return
+
+        enrolled_qs = self.students.values('id')
+        existing = FriendshipStatus.objects.filter(
+            owner_id__in=enrolled_qs,
+            other_id__in=enrolled_qs,
+        )
+        if student_ids != enrolled:
+            existing = existing.filter(
+                models.Q(owner_id__in=student_ids) |
+                models.Q(other_id__in=student_ids)
+            )
+        missing = required.difference(
+            existing.values_list('owner_id', 'other_id')
+        )
+        FriendshipStatus.objects.bulk_create(
+            [FriendshipStatus(owner_id=owner,
+                              other_id=other,
+                              status=FriendshipStatus.STATUS_COLLEAGUE)
+             for (owner, other) in sorted(missing)],
+            batch_size=500,
+        )
 
     def get_absolute_url(self):
         return url_reverse('course-detail', args=(self.pk,))
@@ -228,13 +259,9 @@ class Course(models.RoutablePageMixin, models.CodeschoolPage):
             visitors can access the course contents.
         """
 
-        if user == self.teacher:
-            return 'teacher'
-        if user in self.staff.all():
-            return 'staff'
-        if user in self.students.all():
-            return 'student'
-        return 'visitor'
+        from cs_core.models.course.roles import get_user_roles
+
+        return get_user_roles(user).get_role(self)
 
     def get_user_activities(self, user):
         """
@@ -264,10 +291,12 @@ class Course(models.RoutablePageMixin, models.CodeschoolPage):
         """Return the date of the next available time slot."""
 
     def can_view(self, user):
-        return user != annonymous_user()
+        return user.is_authenticated()
 
     def can_edit(self, user):
-        return user in self.teachers.all() or user == self.owner
+        from cs_core.models.course.roles import get_user_roles
+
+        return get_user_roles(user).can_edit(self)
 
     def get_context(self, request, *args, **kwargs):
         context = super().get_context(request, *args, **kwargs)
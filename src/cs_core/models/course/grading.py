@@ -1,7 +1,17 @@
+import csv
+import functools
+import operator
+import tempfile
 from django.utils.translation import ugettext_lazy as _, ugettext as __
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.db import transaction
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
 from codeschool import models
+from cs_core.models.activity import Activity, autograde_signal
 
 
 @receiver(post_save, sender='cs_core.Course')
@@ -10,7 +20,12 @@ def save_gradebook(instance, created, **kwargs):
          instance.add_child(instance=GradableList())
 
 
-class GradableList(models.CodeschoolPage):
+@receiver(autograde_signal)
+def update_grade_matrix(response_item, **kwargs):
+    GradeMatrixCell.register_grade(response_item)
+
+
+class GradableList(models.RoutablePageMixin, models.CodeschoolPage):
     """
     A page that displays the grades for all gradable activities that are
     computed into the final course grade.
@@ -21,6 +36,25 @@ class GradableList(models.CodeschoolPage):
         kwargs.setdefault('slug', 'gradebook')
         super().__init__(*args, **kwargs)
 
+    @property
+    def course(self):
+        return self.get_parent().specific
+
+    # Serving and routes
+    @models.route(r'^export.csv$')
+    def route_export_csv(self, request):
+        course = self.course
+        if not course.can_edit(request.user):
+            raise PermissionDenied
+        return grade_matrix_csv_response(course)
+
+    @models.route(r'^export.xlsx$')
+    def route_export_xlsx(self, request):
+        course = self.course
+        if not course.can_edit(request.user):
+            raise PermissionDenied
+        return grade_matrix_xlsx_response(course)
+
 
 class GradableDefinition(models.Model):
     """
@@ -31,3 +65,279 @@ class GradableDefinition(models.Model):
     @property
     def grades_page(self):
         return self.course.grades_page
+
+
+class GradeMatrixCell(models.Model):
+    """
+    Best grade of a student in an activity of a course.
+
+    This is a materialized view of the final grades of all Response objects
+    of an activity. Cells are updated incrementally when response items are
+    graded and can be rebuilt in bulk with :meth:`rebuild`.
+    """
+
+    class Meta:
+        unique_together = [('course', 'user', 'activity')]
+
+    course = models.ForeignKey(
+        'cs_core.Course',
+        related_name='grade_matrix',
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        models.User,
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    activity = models.ForeignKey(
+        'wagtailcore.Page',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    grade = models.DecimalField(
+        _('grade'),
+        max_digits=6,
+        decimal_places=3,
+        default=0,
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+    )
+
+    def __str__(self):
+        return '%s/%s: %s' % (self.user, self.activity_id, self.grade)
+
+    @classmethod
+    def register_grade(cls, response_item):
+        """
+        Update the cell associated with the given graded response item.
+
+        The grade only increases, hence the cell is updated with a single
+        conditional UPDATE query. Activities that do not belong to a course
+        are ignored. Grades that decrease must be propagated with
+        :meth:`refresh`.
+        """
+
+        grade = response_item.final_grade
+        if grade is None:
+            return
+        response = response_item.response
+        course_id = get_course_id(response.activity_id)
+        if course_id is None:
+            return
+
+        with transaction.atomic():
+            cells = cls.objects.filter(
+                course_id=course_id,
+                user_id=response.user_id,
+                activity_id=response.activity_id,
+            )
+            updated = cells\
+                .filter(grade__lt=grade)\
+                .update(grade=grade, modified=timezone.now())
+            if not updated:
+                cls.objects.get_or_create(
+                    course_id=course_id,
+                    user_id=response.user_id,
+                    activity_id=response.activity_id,
+                    defaults={'grade': grade},
+                )
+
+    @classmethod
+    def refresh(cls, response_ids):
+        """
+        Recompute the cells associated with the given response ids from the
+        final grades of the response objects.
+
+        This is used when final grades decrease, which is not handled by
+        :meth:`register_grade`. Only existing cells are updated.
+        """
+
+        Response = apps.get_model('cs_core', 'Response')
+        pairs = Response.objects\
+            .filter(id__in=list(response_ids))\
+            .values_list('user_id', 'activity_id')\
+            .order_by()
+        pairs = set(pairs)
+        if not pairs:
+            return
+        user_ids = {user_id for user_id, _ in pairs}
+        activity_ids = {activity_id for _, activity_id in pairs}
+        data = Response.objects\
+            .filter(user_id__in=user_ids, activity_id__in=activity_ids)\
+            .values('user_id', 'activity_id')\
+            .annotate(grade=models.Max('final_grade'))\
+            .order_by()
+
+        # Group cells by grade so each distinct grade takes a single query
+        courses = {pk: get_course_id(pk) for pk in activity_ids}
+        changed = {}
+        for row in data:
+            user_id, activity_id = row['user_id'], row['activity_id']
+            course_id = courses[activity_id]
+            if (user_id, activity_id) in pairs and course_id is not None:
+                cell = models.Q(course_id=course_id, user_id=user_id,
+                                activity_id=activity_id)
+                changed.setdefault(row['grade'] or 0, []).append(cell)
+
+        with transaction.atomic():
+            for grade, cells in changed.items():
+                cls.objects\
+                    .filter(functools.reduce(operator.or_, cells))\
+                    .update(grade=grade, modified=timezone.now())
+
+    @classmethod
+    def rebuild(cls, course):
+        """
+        Recompute all cells of the given course from the final grades of the
+        response objects.
+
+        Uses a single aggregate query and a bulk insert.
+        """
+
+        Response = apps.get_model('cs_core', 'Response')
+        data = Response.objects\
+            .filter(activity__path__startswith=course.path,
+                    activity__depth__gt=course.depth)\
+            .values('user_id', 'activity_id')\
+            .annotate(grade=models.Max('final_grade'))\
+            .order_by()
+        cells = [
+            cls(course_id=course.id,
+                user_id=row['user_id'],
+                activity_id=row['activity_id'],
+                grade=row['grade'] or 0)
+            for row in data.iterator()
+        ]
+        with transaction.atomic():
+            cls.objects.filter(course_id=course.id).delete()
+            cls.objects.bulk_create(cells, batch_size=1000)
+        return len(cells)
+
+
+def get_course_id(page_id):
+    """
+    Return the id of the course that contains the page with the given id or
+    None if the page is not inside a course.
+    """
+
+    Course = apps.get_model('cs_core', 'Course')
+    path = models.Page.objects\
+        .filter(id=page_id)\
+        .values_list('path', flat=True)\
+        .first()
+    if path is None:
+        return None
+    step = models.Page.steplen
+    ancestors = [path[:i] for i in range(step, len(path), step)]
+    return Course.objects\
+        .filter(path__in=ancestors)\
+        .values_list('id', flat=True)\
+        .first()
+
+
+def course_activities(course):
+    """
+    Return a queryset with all activity pages inside the given course ordered
+    by their position in the page tree.
+    """
+
+    activity_models = [
+        model for model in apps.get_models()
+        if issubclass(model, Activity) and not model._meta.proxy
+    ]
+    content_types = models.ContentType.objects\
+        .get_for_models(*activity_models).values()
+    return models.Page.objects\
+        .descendant_of(course)\
+        .filter(content_type__in=content_types)\
+        .order_by('path')
+
+
+def iter_grade_matrix(course):
+    """
+    Iterate over the rows of the grade matrix of the given course.
+
+    The first row is the header and each other row corresponds to an enrolled
+    student. Rows are produced while the database cursors are consumed and
+    the full matrix is never held in memory.
+    """
+
+    activities = list(course_activities(course).values_list('id', 'title'))
+    column = {pk: idx for idx, (pk, _title) in enumerate(activities)}
+    yield [__('Username'), __('Name')] + [title for _pk, title in activities]
+
+    students = course.students\
+        .order_by('username', 'id')\
+        .values_list('id', 'username', 'first_name', 'last_name')
+    cells = GradeMatrixCell.objects\
+        .filter(course_id=course.id,
+                user__in=course.students.all(),
+                activity_id__in=list(column))\
+        .order_by('user__username', 'user_id')\
+        .values_list('user_id', 'activity_id', 'grade')
+    cells = iter(cells.iterator())
+    cell = next(cells, None)
+
+    # Students and cells are sorted in the same order: we walk both sequences
+    # in lock step
+    for user_id, username, first_name, last_name in students.iterator():
+        grades = [0] * len(activities)
+        while cell is not None and cell[0] == user_id:
+            grades[column[cell[1]]] = float(cell[2])
+            cell = next(cells, None)
+        name = ('%s %s' % (first_name, last_name)).strip()
+        yield [username, name] + grades
+
+
+class _Echo:
+    """
+    Pseudo-buffer that returns the written value instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def grade_matrix_csv_response(course):
+    """
+    Return a streaming response with the grade matrix as a CSV file.
+    """
+
+    writer = csv.writer(_Echo())
+    rows = (writer.writerow(row) for row in iter_grade_matrix(course))
+    response = StreamingHttpResponse(rows, content_type='text/csv')
+    response['Content-Disposition'] = \
+        'attachment; filename="%s-grades.csv"' % course.slug
+    return response
+
+
+def grade_matrix_xlsx_response(course):
+    """
+    Return a response with the grade matrix as a XLSX file.
+
+    Requires the optional xlsxwriter package. The spreadsheet is written row
+    by row to a temporary file, which is then streamed to the client.
+    """
+
+    try:
+        import xlsxwriter
+    except ImportError:
+        raise ImproperlyConfigured(
+            'XLSX export requires the xlsxwriter package.'
+        )
+
+    fd = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(fd, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    for idx, row in enumerate(iter_grade_matrix(course)):
+        worksheet.write_row(idx, 0, row)
+    workbook.close()
+    fd.seek(0)
+
+    content_type = ('application/vnd.openxmlformats-officedocument.'
+                    'spreadsheetml.sheet')
+    response = FileResponse(fd, content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment; filename="%s-grades.xlsx"' % course.slug
+    return response
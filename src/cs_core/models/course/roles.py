@@ -0,0 +1,153 @@
+import itertools
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from codeschool import models
+from .course import Course
+
+# Incremented every time an enrollment changes in this process. Resolvers
+# created before the change are discarded on their next use.
+_generation = itertools.count()
+_current_generation = next(_generation)
+
+
+@receiver(m2m_changed, sender=Course.teachers.through)
+@receiver(m2m_changed, sender=Course.students.through)
+@receiver(m2m_changed, sender=Course.staff.through)
+def on_enrollment_change(action, **kwargs):
+    global _current_generation
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _current_generation = next(_generation)
+
+
+@receiver(post_save, sender=Course)
+def on_course_save(update_fields=None, **kwargs):
+    global _current_generation
+
+    # Course owners have the teacher role
+    if update_fields is None or 'owner' in update_fields:
+        _current_generation = next(_generation)
+
+
+def get_user_roles(user):
+    """
+    Return the CourseRoles object for the given user.
+
+    The resolver is stored in the user instance. Since Django creates a new
+    user object for each request, memberships are loaded at most once per
+    request.
+    """
+
+    roles = getattr(user, '_course_roles', None)
+    if roles is None or roles.generation != _current_generation:
+        roles = user._course_roles = CourseRoles(user)
+    return roles
+
+
+class CourseRoles:
+    """
+    Course memberships of an user.
+
+    All memberships are loaded with one query per role and role and permission
+    checks are answered from memory. Use the get_user_roles() function instead
+    of creating instances directly.
+    """
+
+    ROLES = ('teacher', 'staff', 'student')
+
+    def __init__(self, user):
+        self.user = user
+        self.generation = _current_generation
+        self.courses = {role: {} for role in self.ROLES}
+
+        if user is None or not user.is_authenticated():
+            return
+
+        querysets = {
+            'teacher': Course.objects.filter(
+                models.Q(teachers=user) | models.Q(owner=user)
+            ),
+            'staff': Course.objects.filter(staff=user),
+            'student': Course.objects.filter(students=user),
+        }
+        for role, qs in querysets.items():
+            data = qs.order_by().values_list('id', 'path').distinct()
+            self.courses[role] = dict(data)
+
+    def course_ids(self, role=None):
+        """
+        Return a set with the ids of all courses in which the user has the
+        given role.
+
+        Role can be any of 'teacher', 'staff', 'student', 'can_edit' or
+        'can_view'. If role is None, return all courses related to the user.
+        """
+
+        return set(self.course_paths(role))
+
+    def course_paths(self, role=None):
+        """
+        Like course_ids(), but return a mapping from course ids to their
+        respective tree paths.
+        """
+
+        if role == 'can_edit':
+            roles = ['teacher']
+        elif role is None or role == 'can_view':
+            roles = self.ROLES
+        elif role in self.ROLES:
+            roles = [role]
+        else:
+            raise ValueError('invalid role: %r' % role)
+
+        result = {}
+        for role in roles:
+            result.update(self.courses[role])
+        return result
+
+    def get_role(self, course):
+        """
+        Return the most privileged role of the user in the given course.
+
+        See :meth:`Course.get_user_role` for the possible values.
+        """
+
+        for role in self.ROLES:
+            if course.id in self.courses[role]:
+                return role
+        return 'visitor'
+
+    def get_page_role(self, page):
+        """
+        Return the most privileged role of the user in the course that contains
+        the given page.
+        """
+
+        for role in self.ROLES:
+            for path in self.courses[role].values():
+                if page.path.startswith(path):
+                    return role
+        return 'visitor'
+
+    def can_edit(self, course):
+        """
+        Return True if user can edit the given course.
+        """
+
+        return course.id in self.courses['teacher']
+
+    def can_edit_page(self, page):
+        """
+        Return True if the given page is inside a course that the user can
+        edit.
+        """
+
+        return self.get_page_role(page) == 'teacher'
+
+    def can_view_page(self, page):
+        """
+        Return True if the given page is inside a course in which the user is
+        enrolled with any role.
+        """
+
+        return self.get_page_role(page) != 'visitor'
@@ -55,4 +55,70 @@ def test_user_profile_is_created_automatically(db, user):
 
 def test_use_access_profile_attributes(db, user_with_profile):
     user, profile = user_with_profile
-    assert user.about_me == profile.about_me
\ No newline at end of file
+    assert user.about_me == profile.about_me
+
+
+#
+# Course enrollment
+#
+def test_register_students_creates_colleague_statuses(db):
+    course = CourseFactory.create(title='Course')
+    students = create_users(3)
+    course.register_students(students[:2])
+    course.register_student(students[2])
+    statuses = models.FriendshipStatus.objects\
+        .filter(owner__in=students)\
+        .values_list('owner_id', 'other_id', 'status')
+    assert len(statuses) == 6
+    assert {status for (_, _, status) in statuses} == {'colleague'}
+
+
+#
+# Course roles
+#
+def test_course_roles_resolve_memberships(db):
+    from cs_core.models.course.roles import get_user_roles
+
+    teacher, student, staff, visitor = create_users(4)
+    course = CourseFactory.create(title='Course', teachers=[teacher])
+    course.register_student(student)
+    course.staff.add(staff)
+
+    assert get_user_roles(teacher).get_role(course) == 'teacher'
+    assert get_user_roles(student).get_role(course) == 'student'
+    assert get_user_roles(staff).get_role(course) == 'staff'
+    assert get_user_roles(visitor).get_role(course) == 'visitor'
+    assert get_user_roles(teacher).can_edit(course)
+    assert not get_user_roles(student).can_edit(course)
+    assert get_user_roles(student).course_ids() == {course.id}
+    assert get_user_roles(student).course_ids('can_edit') == set()
+    assert get_user_roles(teacher).course_ids('can_edit') == {course.id}
+    with pytest.raises(ValueError):
+        get_user_roles(student).course_ids('foo')
+
+
+def test_course_roles_are_refreshed_after_enrollment(db):
+    from cs_core.models.course.roles import get_user_roles
+
+    course = CourseFactory.create(title='Course')
+    user = create_users(1)[0]
+    roles = get_user_roles(user)
+    assert roles.get_role(course) == 'visitor'
+    assert get_user_roles(user) is roles
+
+    course.register_student(user)
+    assert get_user_roles(user) is not roles
+    assert get_user_roles(user).get_role(course) == 'student'
+
+
+def test_course_roles_are_refreshed_after_owner_change(db):
+    from cs_core.models.course.roles import get_user_roles
+
+    course = CourseFactory.create(title='Course')
+    user = create_users(1)[0]
+    assert not get_user_roles(user).can_edit(course)
+
+    course.owner = user
+    course.save()
+    assert get_user_roles(user).can_edit(course)
+    assert course.can_edit(user)
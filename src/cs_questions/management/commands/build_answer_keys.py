@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from cs_questions.models import CodingIoQuestion
+
+
+class Command(BaseCommand):
+    help = 'build the answer keys of coding io questions and store them in ' \
+           'the answer key cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question', '-q', type=int, action='append',
+                            help='only the question with the given id (can '
+                                 'be repeated).')
+
+    def handle(self, *args, question=None, **options):
+        questions = CodingIoQuestion.objects.all()
+        if question:
+            questions = questions.filter(id__in=question)
+        count = 0
+        for obj in questions:
+            obj.build_answer_keys()
+            count += 1
+        print('Built answer keys for %s questions.' % count)
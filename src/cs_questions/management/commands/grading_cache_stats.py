@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from cs_questions.models.coding_io import grading_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'show the (approximate) hit ratio of the grading cache.'
+
+    def handle(self, *args, **options):
+        stats = grading_cache_stats()
+        print('Hits: %s' % stats['hits'])
+        print('Misses: %s' % stats['misses'])
+        if stats['ratio'] is None:
+            print('Hit ratio: -')
+        else:
+            print('Hit ratio: %.1f%%' % (100 * stats['ratio']))
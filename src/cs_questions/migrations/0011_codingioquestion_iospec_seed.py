@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cs_questions', '0010_auto_20160620_2019'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codingioquestion',
+            name='iospec_seed',
+            field=models.CharField(blank=True, help_text='Seed used to generate the random inputs of the iospec template. The same seed always produces the same expanded test cases. If left blank, the seed is derived from the response template and the number of iospec expansions.', max_length=32, verbose_name='random seed'),
+        ),
+    ]
@@ -1,5 +1,16 @@
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from django import forms
 from django.conf import settings
+from django.core.cache import caches, cache as default_cache, \
+    InvalidCacheBackendError
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from django.utils.html import mark_safe, escape
 from django.utils.translation import ugettext_lazy as _
@@ -13,11 +24,15 @@ from codeschool.forms import register_parent_prefetch
 from codeschool.shortcuts import lazy
 from codeschool.utils import md5hash
 from cs_core.models import ProgrammingLanguage, programming_language, \
-    bound_property
+    bound_property, Response
 from cs_questions.models import Question, QuestionResponseItem, \
     register_response_item
 from cs_questions.renderers import render_html
 from iospec import parse_string as parse_iospec
+from iospec.feedback import testcase_hash
+from wagtail.wagtailcore.signals import page_published
+
+logger = logging.getLogger(__name__)
 
 
 # noinspection PyPropertyAccess
@@ -53,6 +68,16 @@ class CodingIoQuestion(Question):
         blank=True,
         help_text=_('A hash to keep track of iospec updates.'),
     )
+    iospec_seed = models.CharField(
+        _('random seed'),
+        max_length=32,
+        blank=True,
+        help_text=_(
+            'Seed used to generate the random inputs of the iospec template. '
+            'The same seed always produces the same expanded test cases. If '
+            'left blank, the seed is derived from the response template and '
+            'the number of iospec expansions.'),
+    )
     timeout = models.FloatField(
         _('timeout in seconds'),
         blank=True,
@@ -86,7 +111,49 @@ class CodingIoQuestion(Question):
         The IoSpec structure corresponding to the iospec_source.
         """
 
-        return parse_iospec(self.iospec_source)
+        return parse_iospec(self.iospec_source, basedir=self.iospec_files_dir)
+
+    @property
+    def iospec_files_dir(self):
+        """
+        Directory with the input files referenced by @file blocks in the
+        iospec template.
+
+        Large inputs are stored in this directory instead of inline in the
+        iospec source. Results refer to these files by their hashes.
+
+        Unsaved questions have no directory and this property is None.
+        """
+
+        if self.pk is None:
+            return None
+        return os.path.join(settings.MEDIA_ROOT, 'iospec', str(self.pk))
+
+    @property
+    def expansion_seed(self):
+        """
+        The seed used to expand the computed inputs of the iospec template.
+        """
+
+        if self.iospec_seed:
+            return self.iospec_seed
+        return md5hash(self.iospec_source + str(self.iospec_size))
+
+    @property
+    def has_deterministic_answer_key(self):
+        """
+        True if the expanded answer key is fully determined by the question
+        data.
+
+        This is the case for questions with an explicit random seed and for
+        questions without computed inputs. Only these questions are eligible
+        for the grading cache.
+        """
+
+        if self.iospec_seed:
+            return True
+        return not any(isinstance(atom, iospec.types.Command)
+                       for case in self.iospec for atom in case)
 
     @property
     def is_answer_key_complete(self):
@@ -150,19 +217,26 @@ class CodingIoQuestion(Question):
         iospec_hash = md5hash(source)
         if self.iospec_hash != iospec_hash:
             try:
-                self.iospec = iospec.parse_string(self.iospec_source)
+                self.iospec = iospec.parse_string(
+                    self.iospec_source, basedir=self.iospec_files_dir,
+                )
             except Exception:
                 raise ValidationError(
                     {'iospec_source': _('invalid iospec syntax')}
                 )
+            if self.pk is None and self.iospec.file_inputs():
+                raise ValidationError(
+                    {'iospec_source': _('@file blocks can only be used after '
+                                        'the question is saved')}
+                )
+
+            self.iospec_hash = iospec_hash
+            if self.pk is None:
+                self.is_usable = self.iospec.is_simple
+                self.is_consistent = True
             else:
-                self.iospec_hash = iospec_hash
-                if self.pk is None:
-                    self.is_usable = self.iospec.is_simple
-                    self.is_consistent = True
-                else:
-                    self.is_usable = self._is_usable(self.iospec)
-                    self.is_consistent = self._is_consistent(self.iospec)
+                self.is_usable = self._is_usable(self.iospec)
+                self.is_consistent = self._is_consistent(self.iospec)
 
     def _is_usable(self, iospec):
         """
@@ -289,9 +363,90 @@ class CodingIoQuestion(Question):
         except AnswerKeyItem.DoesNotExist:
             return None
 
+    @property
+    def answer_key_revision(self):
+        """
+        A hash that changes whenever the expanded answer keys might change.
+
+        It is computed from the stored iospec_hash and does not require
+        hashing the full iospec source.
+        """
+
+        iospec_hash = self.iospec_hash or md5hash(self.iospec_source)
+        return md5hash('%s:%s:%s' % (iospec_hash, self.iospec_size,
+                                     self.iospec_seed))
+
+    def answer_key_cache_key(self, language):
+        """
+        Return the key used to store the answer key for the given language in
+        the answer key cache.
+        """
+
+        return '%s%s:%s:%s' % (ANSWER_KEY_CACHE_PREFIX, self.pk,
+                               self.answer_key_revision, language.ref)
+
     def answer_key(self, language=None):
         """
         Return the answer key IoSpec object associated with the given language.
+
+        Answer keys are stored in a cache shared by all workers and are
+        usually built in the background when the question is published or an
+        answer key is saved (see :meth:`build_answer_keys`). The cache holds
+        the source of the expanded answer key, which is parsed only once per
+        process. Keys are computed here if they are not found in the cache.
+        """
+
+        language = self._language(language)
+        cache = get_answer_key_cache()
+        cache_key = self.answer_key_cache_key(language)
+        key_hash = cache.get(cache_key + ':hash')
+        if key_hash is not None:
+            memo_key = cache_key, key_hash
+            key = _parsed_answer_keys.get(memo_key)
+            if key is not None:
+                return key
+            source = cache.get(cache_key)
+            if source is not None:
+                key = parse_iospec(source, basedir=self.iospec_files_dir)
+                if len(_parsed_answer_keys) >= ANSWER_KEY_MEMO_SIZE:
+                    _parsed_answer_keys.clear()
+                _parsed_answer_keys[memo_key] = key
+                return key
+
+        key = self.answer_key_compute(language)
+        self._cache_answer_key(language, key)
+        return key
+
+    def answer_key_hash(self, language=None):
+        """
+        Return a hash of the expanded answer key for the given language.
+
+        The hash is stored in the answer key cache next to the answer key, so
+        it is computed once per revision instead of once per submission.
+        """
+
+        language = self._language(language)
+        cache_key = self.answer_key_cache_key(language) + ':hash'
+        value = get_answer_key_cache().get(cache_key)
+        if value is None:
+            value = md5hash(self.answer_key(language).hash_source())
+        return value
+
+    def _cache_answer_key(self, language, key):
+        # The unexpanded iospec is returned as a fallback if the reference
+        # program fails. It is not a valid answer key and is never cached.
+        if key is self.iospec:
+            return
+        cache_key = self.answer_key_cache_key(language)
+        get_answer_key_cache().set_many({
+            cache_key: key.source(),
+            cache_key + ':hash': md5hash(key.hash_source()),
+        })
+
+    def answer_key_compute(self, language):
+        """
+        Compute the expanded answer key for the given language, updating the
+        corresponding AnswerKeyItem, if necessary.
         """
 
         key = self.answer_key_item(language)
@@ -301,17 +456,37 @@ class CodingIoQuestion(Question):
                 if self.iospec.is_simple:
                     raise ValueError('no valid iospec is defined for the '
                                      'question')
-                return iospec.expand_inputs(self.iospec_size)
+                expanded = self.iospec.copy()
+                expanded.expand_inputs(self.iospec_size,
+                                       seed=self.expansion_seed)
+                return expanded
             key = new_key
 
         # We check if the answer key item is synchronized with the parent hash
         if key.iospec_hash != key.parent_hash():
             try:
-                key.update(self.iospec)
+                key.update()
             except ValidationError:
                 return self.iospec
         return key.iospec
 
+    def build_answer_keys(self):
+        """
+        Compute the answer keys for all languages and store them in the answer
+        key cache.
+
+        This is called in the background when the question is published or
+        when an answer key is saved (see build_answer_keys_in_background()),
+        by the build_answer_keys management command and before regrading.
+        """
+
+        for item in self.answer_key_items.select_related('language'):
+            key = self.answer_key_compute(item.language)
+            self._cache_answer_key(item.language, key)
+
+    def prepare_regrade(self):
+        self.build_answer_keys()
+
     def placeholder(self, language=None):
         """
         Return the placeholder text for the given language.
@@ -384,7 +559,7 @@ class CodingIoQuestion(Question):
         language = programming_language(language)
         self.bind(client.request, language=language, **kwargs)
         response = self.register_response_item(source, autograde=True)
-        html = render_html(response.feedback)
+        html = response.render_feedback('html')
         client.dialog(html)
 
     @srvice.route(r'^placeholder/$')
@@ -404,6 +579,7 @@ class CodingIoQuestion(Question):
     content_panels = Question.content_panels[:]
     content_panels.insert(-1, panels.MultiFieldPanel([
         panels.FieldPanel('iospec_size'),
+        panels.FieldPanel('iospec_seed'),
         panels.FieldPanel('iospec_source'),
     ], heading=_('IoSpec definitions')))
     content_panels.insert(
@@ -475,7 +651,8 @@ class AnswerKeyItem(models.Model):
 
     @lazy
     def iospec(self):
-        return parse_iospec(self.iospec_source)
+        return parse_iospec(self.iospec_source,
+                            basedir=self.question.iospec_files_dir)
 
     iospec_size = property(lambda x: x.question.iospec_size)
 
@@ -494,25 +671,72 @@ class AnswerKeyItem(models.Model):
         if parent_hash != self.iospec_hash or source_hash != self.source_hash:
             iospec = self.question.iospec
             result = self._update_state(iospec, self.source, self.language)
+
+            # Cleaned items are saved by the admin. Responses graded with the
+            # previous answer key are marked for regrading after the save.
+            if self.iospec_source:
+                self._mark_responses = True
             self.iospec_source = result.source()
+            self.__dict__.pop('iospec', None)
             self.source_hash = source_hash
             self.iospec_hash = parent_hash
 
-    def update(self, commit=True):
+    def update(self, commit=True, regrade=False):
         """
         Update the internal iospec source and hash keys to match the given
         parent iospec value.
 
+        If commit and regrade are True, it also marks the responses graded
+        with the previous answer key for regrading (see
+        :meth:`mark_responses`). Answer keys that are updated on demand never
+        mark responses: this only happens after an explicit save of a cleaned
+        answer key (see :meth:`save`).
+
         It raises a ValidationError if the source code is invalid.
         """
 
+        mark_responses = regrade and bool(self.iospec_source)
         iospec = self.question.iospec
         result = self._update_state(iospec, self.source, self.language)
         self.iospec_source = result.source()
+        self.__dict__.pop('iospec', None)
         self.source_hash = md5hash(self.source)
         self.iospec_hash = self.parent_hash()
         if commit:
             self.save()
+            if mark_responses:
+                self.mark_responses()
+
+    def mark_responses(self):
+        """
+        Mark the response items graded with a previous version of this answer
+        key for regrading.
+
+        Items are set back to the pending state with two UPDATE queries and no
+        code is executed. Final grades are reset, unless they were manually
+        overridden. Marked items are graded by "manage.py regrade --pending"
+        (see :meth:`CodingIoResponseItem.regrade`) or when their feedback is
+        requested.
+
+        Return the number of marked response items.
+        """
+
+        # response_data is stored as JSON text, so we match the serialized
+        # language field in the query
+        language = self.language.ref
+        language_re = r'"language":\s*%s' % re.escape(json.dumps(language))
+        items = CodingIoResponseItem.objects.filter(
+            response__activity_id=self.question_id,
+            status=CodingIoResponseItem.STATUS_DONE,
+            response_data__regex=language_re,
+        )
+        pending = CodingIoResponseItem.STATUS_PENDING
+        with transaction.atomic():
+            count = items\
+                .filter(manual_override=True)\
+                .update(status=pending)
+            count += items.update(status=pending, final_grade=None)
+        return count
 
     def _update_state(self, iospec, source, language):
         """
@@ -525,7 +749,8 @@ class AnswerKeyItem(models.Model):
         # string
         language = language.ejudge_ref()
         if len(iospec) <= self.iospec_size:
-            iospec.expand_inputs(self.iospec_size)
+            iospec.expand_inputs(self.iospec_size,
+                                 seed=self.question.expansion_seed)
         result = run_code(source, iospec, language)
 
         # Check if the result has runtime or build errors
@@ -566,6 +791,9 @@ class AnswerKeyItem(models.Model):
             self.iospec_source = self.iospec.source()
         super().save(*args, **kwds)
 
+        if self.__dict__.pop('_mark_responses', False):
+            self.mark_responses()
+
     def run(self, source=None, iospec=None):
         """
         Runs the given source against the given iospec.
@@ -585,11 +813,13 @@ class AnswerKeyItem(models.Model):
 
     def parent_hash(self):
         """
-        Return the iospec hash from the question current iospec/iospec_size.
+        Return the iospec hash from the question current iospec/iospec_size
+        and random seed.
         """
 
         parent = self.question
-        return md5hash(parent.iospec_source + str(parent.iospec_size))
+        return md5hash(parent.iospec_source + str(parent.iospec_size) +
+                       parent.iospec_seed)
 
     def __repr__(self):
         return '<AnswerKey: %s, %s)' % (self.question, self.language)
@@ -636,8 +866,12 @@ class CodingIoResponseItem(QuestionResponseItem):
         if not self.feedback_data:
             return None
 
+        # Items marked for regrading have no final grade
+        grade = self.final_grade
+        if grade is None:
+            grade = self.given_grade
         data = dict(self.feedback_data)
-        data['grade'] = self.final_grade / 100
+        data['grade'] = grade / 100
         del data['source']
         del data['language']
         return iospec.feedback.Feedback.from_json(data)
@@ -649,6 +883,21 @@ class CodingIoResponseItem(QuestionResponseItem):
     feedback_message = property(lambda x: x.feedback_data.get('message'))
     feedback_status = property(lambda x: x.feedback_data.get('status'))
 
+    # Templates for rendering feedback are provided by iospec and by the
+    # render/feedback.jinja2 template.
+    feedback_template_version = '3-' + iospec.__version__
+
+    def render_feedback_compute(self, format):
+        feedback = self.feedback
+        if feedback is None:
+            return super().render_feedback_compute(format)
+        elif format == 'html':
+            return render_html(feedback)
+        elif format == 'latex':
+            return feedback.as_latex()
+        else:
+            return feedback.as_text()
+
     @property
     def answer_key(self):
         return self.question.answer_key(self.language)
@@ -675,7 +924,12 @@ class CodingIoResponseItem(QuestionResponseItem):
         source = self.source
         language_ref = self.language.ejudge_ref()
         answer_key = self.answer_key
-        feedback = grade_code(source, answer_key, lang=language_ref)
+        if self.question.has_deterministic_answer_key:
+            answer_key_hash = self.question.answer_key_hash(self.language)
+            feedback = grade_code_cached(source, answer_key, lang=language_ref,
+                                         answer_key_hash=answer_key_hash)
+        else:
+            feedback = grade_code(source, answer_key, lang=language_ref)
 
         # Save data and return grade
         self.update_feedback(feedback, update_grade=False)
@@ -689,7 +943,7 @@ class CodingIoResponseItem(QuestionResponseItem):
 
         self.feedback_data.update(
             answer_key=feedback.answer_key.to_json(),
-            testcase=feedback.answer_key.to_json(),
+            testcase=feedback.testcase.to_json(),
             status=feedback.status,
         )
         if feedback.message:
@@ -697,11 +951,74 @@ class CodingIoResponseItem(QuestionResponseItem):
         if feedback.hint:
             self.feedback_data['hint'] = self.feedback.hint
 
+        if feedback.outcomes is not None:
+            self.feedback_data['outcomes'] = feedback.outcomes
         if update_grade:
             self.given_grade = feedback.grade * 100
 
         self.feedback = feedback
 
+    def regrade(self, method, commit=True, silent=False):
+        """
+        Recompute the grade for the response item.
+
+        Items marked by :meth:`AnswerKeyItem.mark_responses` reuse the test
+        case outcomes of their previous grading: items that still fail an
+        unchanged test case keep their grade and items that passed all
+        unchanged test cases only run the new ones. All other items are
+        regraded as in :meth:`ResponseItem.regrade`.
+        """
+
+        outcomes = None
+        if self.status == self.STATUS_PENDING and self.given_grade is not None:
+            outcomes = (self.feedback_data or {}).get('outcomes')
+        if outcomes is None:
+            return super().regrade(method, commit=commit, silent=silent)
+
+        cases = list(self.answer_key)
+        hashes = [testcase_hash(case) for case in cases]
+        passed = set(outcomes['passed'])
+        failed = set(outcomes['failed'])
+        changed = [case for case, case_hash in zip(cases, hashes)
+                   if case_hash not in passed and case_hash not in failed]
+
+        self.status = self.STATUS_DONE
+        if failed.intersection(hashes) or not (changed or failed):
+            if self.final_grade is None:
+                self.final_grade = self.given_grade
+        elif changed:
+            self.regrade_cases(changed, passed=passed.intersection(hashes),
+                               commit=False)
+        else:
+            return super().regrade('update', commit=commit, silent=silent)
+
+        if commit:
+            self.save(update_fields=['status', 'feedback_data', 'given_grade',
+                                     'final_grade'])
+            Response.update_all(Response.objects.filter(pk=self.response_id))
+        return True
+
+    def regrade_cases(self, cases, passed=(), commit=True):
+        """
+        Run the source code only against the given answer key test cases and
+        update the grade and feedback.
+
+        This is used after an answer key changes: ``passed`` is a collection
+        of hashes of the remaining test cases that are known to pass.
+        """
+
+        language_ref = self.language.ejudge_ref()
+        feedback = grade_code(self.source, iospec.IoSpec(cases),
+                              lang=language_ref)
+        feedback.outcomes['passed'].extend(sorted(passed))
+        self.update_feedback(feedback)
+        if not self.manual_override:
+            self.final_grade = self.given_grade
+        self.clear_feedback_cache()
+        if commit:
+            self.save(update_fields=['feedback_data', 'given_grade',
+                                     'final_grade'])
+
 
 # We define a fake abstract model just to use the ModelForm class since it will
 # be easier to re-use the automatic model than to create the ForeignKey form
@@ -744,3 +1061,187 @@ def grade_code(source, answer_key, lang=None):
                            sandbox=settings.CODESCHOOL_USE_SANDBOX)
 
 
+
+
+#: Prefix for all keys in the answer key cache
+ANSWER_KEY_CACHE_PREFIX = 'cs_questions.answer-key:'
+
+#: Maximum number of parsed answer keys kept in memory by each process
+ANSWER_KEY_MEMO_SIZE = 256
+
+# Parsed answer keys indexed by (cache key, answer key hash). The hash changes
+# whenever the cached source changes, so entries never become stale.
+_parsed_answer_keys = {}
+
+# Answer keys are built by a single background worker per process. Questions
+# waiting in its queue are not scheduled again.
+_answer_key_worker = ThreadPoolExecutor(max_workers=1)
+_answer_key_queue = set()
+_answer_key_lock = threading.Lock()
+
+
+def get_answer_key_cache():
+    """
+    Return the cache object that stores expanded answer keys.
+
+    Answer keys share the grading cache, if it is enabled, since both must be
+    visible to all workers.
+    """
+
+    return get_grading_cache() or default_cache
+
+
+def build_answer_keys_in_background(question_id):
+    """
+    Build the answer keys for the question with the given id in a background
+    worker after the current transaction commits.
+    """
+
+    def submit():
+        with _answer_key_lock:
+            if question_id in _answer_key_queue:
+                return
+            _answer_key_queue.add(question_id)
+        _answer_key_worker.submit(_build_answer_keys, question_id)
+
+    transaction.on_commit(submit)
+
+
+def _build_answer_keys(question_id):
+    # Changes saved while the keys are built must schedule a new build
+    with _answer_key_lock:
+        _answer_key_queue.discard(question_id)
+    try:
+        question = CodingIoQuestion.objects.get(id=question_id)
+        question.build_answer_keys()
+    except Exception:
+        logger.exception('error building answer keys for question %s',
+                         question_id)
+    finally:
+        connection.close()
+
+
+@receiver(page_published, sender=CodingIoQuestion)
+def on_question_published(instance, **kwargs):
+    build_answer_keys_in_background(instance.id)
+
+
+@receiver(post_save, sender=AnswerKeyItem)
+def on_answer_key_saved(instance, **kwargs):
+    if instance.question_id is not None:
+        # The revision does not track the reference source, so we have to
+        # remove the outdated key explicitly
+        key = instance.question.answer_key_cache_key(instance.language)
+        get_answer_key_cache().delete_many([key, key + ':hash'])
+        build_answer_keys_in_background(instance.question_id)
+
+
+#: Prefix for all keys in the grading cache
+GRADING_CACHE_PREFIX = 'cs_questions.grading:'
+
+
+def get_grading_cache():
+    """
+    Return the cache object that stores grading results or None if the
+    grading cache is disabled.
+    """
+
+    name = getattr(settings, 'CODESCHOOL_GRADING_CACHE', None)
+    if name is None:
+        return None
+    try:
+        return caches[name]
+    except InvalidCacheBackendError:
+        return None
+
+
+def grading_cache_key(source, answer_key, lang, answer_key_hash=None):
+    """
+    Return the grading cache key for the given source, answer key and
+    language.
+
+    The key also depends on the versions of ejudge and iospec, so results are
+    invalidated when the judge is upgraded. Callers that grade many
+    submissions against the same answer key should pass its precomputed hash
+    (see :meth:`CodingIoQuestion.answer_key_hash`).
+    """
+
+    if answer_key_hash is None:
+        answer_key_hash = md5hash(answer_key.hash_source())
+
+    # Only line endings and trailing whitespace at the end of the file are
+    # normalized: whitespace elsewhere may be significant (e.g., inside
+    # string literals)
+    source = source.replace('\r\n', '\n').rstrip()
+    data = '\0'.join([
+        md5hash(source),
+        answer_key_hash,
+        lang,
+        ejudge.__version__,
+        iospec.__version__,
+    ])
+    return GRADING_CACHE_PREFIX + md5hash(data)
+
+
+def grade_code_cached(source, answer_key, lang=None, answer_key_hash=None):
+    """
+    Like grade_code(), but reuse results for identical submissions that were
+    stored in the grading cache.
+
+    Callers must only use this function for deterministic answer keys. Timeout
+    errors depend on the server load and are never cached.
+    """
+
+    cache = get_grading_cache()
+    if cache is None:
+        return grade_code(source, answer_key, lang)
+
+    key = grading_cache_key(source, answer_key, lang, answer_key_hash)
+    data = cache.get(key)
+    if data is not None:
+        _grading_cache_count(cache, 'hits')
+        return iospec.feedback.Feedback.from_json(data)
+
+    _grading_cache_count(cache, 'misses')
+    feedback = grade_code(source, answer_key, lang)
+    if feedback.status != 'error-timeout':
+        data = feedback.to_json()
+        data['grade'] = str(feedback.grade)
+        cache.set(key, data)
+    return feedback
+
+
+def _grading_cache_count(cache, name):
+    # Counters are approximate: incr() is not atomic in all cache backends
+    # (e.g., FileBasedCache reads and rewrites the value) and concurrent
+    # workers may lose some increments. They are only used for statistics.
+    key = GRADING_CACHE_PREFIX + name
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted between the add and incr calls
+        cache.add(key, 1, timeout=None)
+
+
+def grading_cache_stats():
+    """
+    Return a dictionary with the number of hits and misses of the grading
+    cache and the corresponding hit ratio.
+
+    The counters are approximate. Backends without an atomic incr(), such as
+    FileBasedCache, may lose increments when several workers grade at the
+    same time.
+    """
+
+    cache = get_grading_cache()
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'ratio': None}
+    hits = cache.get(GRADING_CACHE_PREFIX + 'hits', 0)
+    misses = cache.get(GRADING_CACHE_PREFIX + 'misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'ratio': hits / total if total else None,
+    }
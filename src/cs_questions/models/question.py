@@ -5,7 +5,9 @@ from codeschool import models
 from codeschool import panels
 from codeschool import blocks
 from codeschool.shortcuts import render
-from cs_core.models import Activity, ResponseItem, ResponseContext, Response
+from codeschool.pagination import paginate_request
+from cs_core.models import Activity, ResponseItem, ResponseContext, Response, \
+    resolve_response_items
 from cs_questions.models import QuestionList
 
 
@@ -86,6 +88,7 @@ class Question(models.RoutablePageMixin, Activity):
         Shows the stats for each question.
         """
 
+        stats = self.get_statistics()
         data = """<dl>
             <dt>Name<dt><dd>{name}<dd>
             <dt>Best grade<dt><dd>{best}<dd>
@@ -98,11 +101,11 @@ class Question(models.RoutablePageMixin, Activity):
         """.format(
             context_id=self.default_context.id,
             name=self.title,
-            best=self.best_final_grade(),
-            mean=self.mean_final_grade(),
-            n_correct=self.correct_responses().count(),
-            n_response_items=self.response_items().count(),
-            n_responses=self.responses.count(),
+            best=stats['best_final_grade'] or 0,
+            mean=stats['mean_final_grade'] or 0,
+            n_correct=stats['correct'],
+            n_response_items=stats['response_items'],
+            n_responses=stats['responses'],
         )
 
         # Renders content
@@ -113,16 +116,20 @@ class Question(models.RoutablePageMixin, Activity):
     @models.route(r'^responses/')
     def response_list_route(self, request):
         """
-        Renders a list of responses
+        Renders a list of responses.
+
+        Responses are paginated from newest to oldest. The "cursor" GET
+        parameter selects the page.
         """
 
         user = request.user
         context = self.get_context(request)
         items = self.response_items(user=user, context='any')
-        items = (x.get_real_instance() for x in items)
+        page = paginate_request(request, items)
         context.update(
             question=self,
-            object_list=items,
+            object_list=resolve_response_items(page.object_list),
+            page=page,
         )
         return render(request, 'cs_questions/response-list.jinja2', context)
 
@@ -24,7 +24,7 @@ class QuestionList(models.RoutablePageMixin, models.RootList):
 
     @property
     def questions(self):
-        return [x.specific for x in self.get_children()]
+        return models.specific_pages(self.get_children())
 
     def __init__(self, *args, **kwargs):
         kwargs.setdefault('title', __('List of questions'))
@@ -37,8 +37,7 @@ class QuestionList(models.RoutablePageMixin, models.RootList):
         registered in the course which were submited using the default context.
         """
 
-        questions = [question.specific for question in self.get_children()]
-        return UserGradebook(questions, user)
+        return UserGradebook(self.questions, user)
 
     # Serving and routes
     @models.route(r'^grades/$')
@@ -86,18 +85,47 @@ class QuizList(models.RootList):
 # Gradebook object (move somewhere else)
 #
 class UserGradebook:
+    """
+    Number of attempts and best grade of an user in a list of questions.
+
+    Only responses submitted using the default context of each question are
+    considered. All grades are fetched with a single aggregate query and no
+    response objects are created in the process.
+    """
+
     def __init__(self, questions, user):
         self.questions = questions
         self.user = user
 
+    def get_grades(self):
+        """
+        Return a mapping from question ids to (attempts, grade) tuples.
+
+        Questions without any response are not included in the result.
+        """
+
+        ids = [question.id for question in self.questions]
+        if not ids:
+            return {}
+        data = core_models.Response.objects\
+            .filter(user=self.user,
+                    activity_id__in=ids,
+                    context__name='default',
+                    context__activity_id=models.F('activity_id'))\
+            .values('activity_id')\
+            .annotate(attempts=models.Count('items'),
+                      grade=models.Max('items__final_grade'))\
+            .order_by()
+        return {
+            row['activity_id']: (row['attempts'], row['grade'] or 0)
+            for row in data
+        }
+
     def __iter__(self):
-        user = self.user
+        grades = self.get_grades()
         for question in self.questions:
-            response = question.get_response(user)
-            attempts = response.num_attempts
-            response.update(force=True)
-            grade = response.final_grade
-            url = question.get_absolute_url()
+            attempts, grade = grades.get(question.id, (0, 0))
+            url = question.url
             title = escape(question.title)
             question_link = '<a href="%s">%s</a>' % (url, title)
             yield (question_link, attempts, '%.1f%%' % grade)
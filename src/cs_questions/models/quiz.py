@@ -1,9 +1,8 @@
 from decimal import Decimal
 from django.utils.translation import ugettext_lazy as _
-from django.contrib.contenttypes.models import ContentType
 from codeschool import models
 from codeschool import panels
-from cs_core.models import ProgrammingLanguage, Activity, Response, ResponseItem
+from cs_core.models import ProgrammingLanguage, Activity, ResponseItem
 from cs_questions.models import Question, QUESTION_STEM_BLOCKS
 
 
@@ -74,9 +73,19 @@ class Quiz(Activity):
     )
 
     # Derived attributes
-    questions = property(lambda x: [i.question for i in x.quiz_items.all()])
     num_questions = property(lambda x: x.quiz_items.count())
 
+    @property
+    def questions(self):
+        """
+        A list with the specific instances of all questions in the quiz.
+        """
+
+        ids = [item.question_id for item in self.quiz_items.all()]
+        questions = models.Page.objects.filter(id__in=ids)
+        questions = {page.id: page for page in models.specific_pages(questions)}
+        return [questions[pk] for pk in ids if pk in questions]
+
     def add_question(self, question, weight=1.0):
         """
         Add a question to the quiz.
@@ -163,8 +172,8 @@ class QuizResponseItem(ResponseItem):
         Register a question response to itself.
         """
 
-        id = str(response.question_id)
-        self.response_data[id].append(response.id)
+        id = str(response.response.activity_id)
+        self.response_data.setdefault(id, []).append(response.id)
         if commit:
             self.save(update_fields=['response_data'])
 
@@ -186,34 +195,45 @@ class QuizResponseItem(ResponseItem):
         """
 
         question_ids = [id for (id, L) in self.response_data.items() if not L]
-        return [p.specific for p in Page.objects.filter(id__in=question_ids)]
+        questions = models.Page.objects.filter(id__in=question_ids)
+        return models.specific_pages(questions)
+
+    def get_question_grades(self):
+        """
+        Return a mapping from question ids to the best grade obtained in each
+        question of the quiz.
+
+        Grades are computed from the response items registered in
+        response_data with a single aggregate query. Unanswered questions have
+        a grade of zero.
+        """
+
+        grades = {int(pk): Decimal(0) for pk in self.response_data}
+        item_ids = [pk for ids in self.response_data.values() for pk in ids]
+        if item_ids:
+            data = ResponseItem.objects\
+                .filter(id__in=item_ids)\
+                .values('response__activity_id')\
+                .annotate(grade=models.Max('final_grade'))\
+                .order_by()
+            for row in data:
+                question_id = row['response__activity_id']
+                if question_id in grades:
+                    grades[question_id] = row['grade'] or Decimal(0)
+        return grades
 
     def autograde_compute(self):
-        grades = []
-
-        for question in self.quiz.questions:
-            responses = set(CodingIoResponse.objects.filter(
-                parent=self, question_for_unbound=question
-            ).values_list('id', flat=True))
-            responses |= set(NumericResponse.objects.filter(
-                parent=self, question_for_unbound=question
-            ).values_list('id', flat=True))
-
-            responses = Response.objects.filter(id__in=responses)
-            if responses:
-                grade = max(responses.values_list('final_grade', flat=True))
-                grades.append(grade)
-            else:
-                grades.append(Decimal(0))
-
-        if grades:
-            print(grades)
-            min_grade = min(grades)
-            del grades[grades.index(min_grade)]
-
-            grade = sum(grades) / (self.num_questions - 1)
-            print(grade, self.num_questions, self.status)
-            return grade
-        return Decimal(0)
-
-Quiz.response_item_class = QuizResponseItem
\ No newline at end of file
+        """
+        Return the mean of the best grades in each question, ignoring the
+        question with the lowest grade.
+        """
+
+        grades = sorted(self.get_question_grades().values())
+        if not grades:
+            return Decimal(0)
+        if len(grades) > 1:
+            del grades[0]
+        return sum(grades) / len(grades)
+
+
+Quiz.response_item_class = QuizResponseItem
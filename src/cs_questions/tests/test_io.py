@@ -36,6 +36,76 @@ def test_fetches_the_correct_answer_keys(question):
     assert question.iospec == key.iospec
 
 
+def test_answer_key_hash_is_computed_once_per_revision(question, python):
+    from codeschool.utils import md5hash
+
+    value = question.answer_key_hash(python)
+    assert value == md5hash(question.answer_key(python).hash_source())
+
+    # The stored hash is reused without expanding the answer key again
+    question.answer_key = None
+    assert question.answer_key_hash(python) == value
+
+
+def test_answer_key_cache_stores_the_expanded_source(question, python):
+    from django.core.management import call_command
+    from cs_questions.models.coding_io import get_answer_key_cache
+
+    cache = get_answer_key_cache()
+    cache_key = question.answer_key_cache_key(python)
+    cache.delete(cache_key)
+    call_command('build_answer_keys', question=[question.id])
+
+    source = cache.get(cache_key)
+    assert isinstance(source, str)
+    key = question.answer_key(python)
+    assert key.source() == source
+    assert source == question.answer_key_compute(python).source()
+
+
+def test_answer_key_is_parsed_once_per_process(question, python,
+                                               monkeypatch):
+    from cs_questions.models import coding_io
+
+    question.build_answer_keys()
+    key = question.answer_key(python)
+    monkeypatch.setattr(coding_io, 'parse_iospec', None)
+    assert question.answer_key(python) is key
+
+
+def test_saving_answer_key_schedules_a_build(question, monkeypatch):
+    from cs_questions.models import coding_io
+
+    scheduled = []
+    monkeypatch.setattr(coding_io, 'build_answer_keys_in_background',
+                        scheduled.append)
+    question.answer_key_item('python').save()
+    assert scheduled == [question.id]
+
+
+def test_answer_key_fallback_is_not_cached(question, python):
+    from cs_questions.models.coding_io import get_answer_key_cache
+
+    # A broken reference program makes answer_key() fall back to the
+    # unexpanded iospec
+    item = question.answer_key_item(python)
+    models.AnswerKeyItem.objects\
+        .filter(pk=item.pk)\
+        .update(source='raise ValueError', iospec_hash='')
+    cache = get_answer_key_cache()
+    cache_key = question.answer_key_cache_key(python)
+    cache.delete_many([cache_key, cache_key + ':hash'])
+
+    assert question.answer_key(python) is question.iospec
+    assert cache.get(cache_key) is None
+    assert cache.get(cache_key + ':hash') is None
+
+
+def test_input_files_dir(question):
+    assert question.iospec_files_dir.endswith(str(question.pk))
+    assert models.CodingIoQuestion().iospec_files_dir is None
+
+
 #
 # Create valid responses
 #
@@ -47,13 +117,27 @@ def test_response_create_valid_feedback(question, user, source_hello_py):
 
     # We are providing a valid source
     keys = resp.feedback_data.keys()
-    assert sorted(keys) == ['answer_key', 'language', 'source', 'status',
-                            'testcase']
+    assert sorted(keys) == ['answer_key', 'language', 'outcomes', 'source',
+                            'status', 'testcase']
+    assert resp.feedback_data['outcomes']['failed'] == []
     assert resp.feedback.testcase == resp.feedback.answer_key
     assert resp.feedback.grade == 1.0
     assert resp.feedback.status == 'ok'
 
 
+def test_response_wrong_answer_stores_student_testcase(question, user):
+    resp = question.register_response_item(user=user,
+                                           source='print("wrong answer")',
+                                           language='python')
+    resp.autograde()
+
+    testcase = resp.feedback_data['testcase']
+    assert testcase != resp.feedback_data['answer_key']
+    assert 'wrong answer' in str(testcase)
+    assert resp.feedback.diff()
+    assert 'wrong answer' in resp.render_feedback('html')
+
+
 def test_fetch_valid_response_from_db(valid_response):
     resp = models.CodingIoResponseItem.objects.get(id=valid_response.pk)
     assert resp.status == valid_response.status
@@ -75,3 +159,260 @@ def test_access_feedback_properties(valid_response):
     assert resp.feedback_hint is None
     assert resp.feedback_message is None
 
+
+
+#
+# Rendered feedback cache
+#
+def test_rendered_feedback_is_cached(valid_response):
+    resp = valid_response
+    html = resp.render_feedback('html')
+    assert 'Congratulations' in html
+    assert resp.render_feedback('latex') == resp.feedback.as_latex()
+
+    # Cached values are used while the feedback does not change
+    resp.render_feedback_compute = lambda format: 'not cached'
+    assert resp.render_feedback('html') == html
+
+    # Regrading invalidates the cache
+    resp.autograde(force=True, commit=False)
+    assert resp.render_feedback('html') == 'not cached'
+
+
+#
+# Pagination
+#
+def test_response_items_keyset_pagination(bound_question, source_hello_py):
+    from codeschool.pagination import keyset_paginate
+
+    for i in range(5):
+        source = '%s\n# %s' % (source_hello_py, i)
+        bound_question.register_response_item(source)
+    items = bound_question.response_items()
+    first = keyset_paginate(items, page_size=3)
+    second = keyset_paginate(items, first.next_cursor, page_size=3)
+    assert len(first) == 3 and first.has_next
+    assert len(second) == 2 and not second.has_next
+    ids = [item.id for item in first] + [item.id for item in second]
+    assert sorted(ids) == sorted(items.values_list('id', flat=True))
+
+
+#
+# Final grades
+#
+@pytest.fixture
+def graded_responses(question, python, source_hello_py):
+    responses = []
+    for user in UserFactory.create_batch(5):
+        item = question.register_response_item(
+            source_hello_py, language=python, user=user, autograde=True
+        )
+        responses.append(item.response)
+    return responses
+
+
+def test_register_grade_only_increases_the_final_grade(valid_response):
+    from cs_core.models import Response
+
+    pk = valid_response.response_id
+    Response.objects.filter(pk=pk).update(final_grade=50)
+    assert not Response.register_grade(pk, 40)
+    assert not Response.register_grade(pk, None)
+    assert Response.register_grade(pk, 60)
+    assert Response.objects.get(pk=pk).final_grade == 60
+
+
+def test_update_all_recomputes_grades_in_chunks(graded_responses):
+    from cs_core.models import Response
+
+    ids = [response.pk for response in graded_responses]
+    queryset = Response.objects.filter(pk__in=ids)
+    queryset.update(final_grade=0)
+    assert Response.update_all(queryset, chunk_size=2) == 5
+    assert set(queryset.values_list('final_grade', flat=True)) == {100}
+    assert Response.update_all(queryset, chunk_size=2) == 0
+
+
+def test_update_all_propagates_decreased_grades_to_grade_matrix(
+        db, python, source_hello_py):
+    from cs_core.models import Response, GradeMatrixCell
+
+    course = CourseFactory.create(title='Course')
+    question = CodingIoQuestionFactory.create(
+        parent_page=course.questions_page
+    )
+    user = UserFactory.create()
+    item = question.register_response_item(
+        source_hello_py, language=python, user=user, autograde=True
+    )
+    cell = GradeMatrixCell.objects.get(course=course, user=user,
+                                       activity_id=question.id)
+    assert cell.grade == 100
+
+    models.CodingIoResponseItem.objects\
+        .filter(pk=item.pk)\
+        .update(final_grade=40)
+    Response.update_all(Response.objects.filter(pk=item.response_id))
+    cell.refresh_from_db()
+    assert cell.grade == 40
+
+
+def test_recompute_grades_command(question, graded_responses):
+    from django.core.management import call_command
+    from cs_core.models import Response
+
+    queryset = Response.objects.filter(activity_id=question.id)
+    queryset.update(final_grade=0)
+    call_command('recompute_grades', activity=[question.id])
+    assert set(queryset.values_list('final_grade', flat=True)) == {100}
+
+
+#
+# Statistics
+#
+def test_statistics_histogram_and_median(question, graded_responses):
+    from django.core.cache import cache
+    from cs_core.models import Response
+
+    for response, grade in zip(graded_responses, [0, 25, 50, 100, None]):
+        Response.objects.filter(pk=response.pk).update(final_grade=grade)
+    cache.clear()
+    stats = question.get_statistics('any')
+    assert stats['responses'] == 5
+    assert stats['median_final_grade'] == 37.5
+    assert stats['mean_final_grade'] == 43.75
+    assert stats['histogram'] == [1, 0, 1, 0, 0, 1, 0, 0, 0, 1]
+
+    # A single graded response is its own median
+    ids = [response.pk for response in graded_responses[1:]]
+    Response.objects.filter(pk__in=ids).update(final_grade=None)
+    cache.clear()
+    assert question.get_statistics('any')['median_final_grade'] == 0
+
+
+def test_statistics_are_cached_until_a_new_grade(question, graded_responses,
+                                                 python, source_hello_py):
+    from django.core.cache import cache
+    from cs_core.models import Response
+
+    cache.clear()
+    stats = question.get_statistics('any')
+    assert stats['responses'] == 5
+
+    # Changes that bypass grading are not seen while the cache is valid
+    Response.objects.filter(pk=graded_responses[0].pk).update(final_grade=0)
+    assert question.get_statistics('any') == stats
+
+    # Grading a new response item invalidates the cache
+    question.register_response_item(
+        source_hello_py, language=python, user=UserFactory.create(),
+        autograde=True
+    )
+    stats = question.get_statistics('any')
+    assert stats['responses'] == 6
+    assert stats['histogram'][0] == 1
+
+
+#
+# Selective regrade
+#
+def test_answer_key_update_does_not_regrade_by_default(question,
+                                                       graded_responses):
+    items = models.CodingIoResponseItem.objects\
+        .filter(response__activity_id=question.id)
+    items.update(given_grade=0, final_grade=0)
+    key = question.answer_key_item('python')
+    key.update()
+    assert set(items.values_list('status', flat=True)) == {'done'}
+
+    # Explicit updates only mark the responses
+    key.update(regrade=True)
+    assert set(items.values_list('status', flat=True)) == {'pending'}
+    assert set(items.values_list('given_grade', flat=True)) == {0}
+
+
+def test_mark_responses_defers_regrading(question, graded_responses):
+    from django.core.management import call_command
+
+    items = models.CodingIoResponseItem.objects\
+        .filter(response__activity_id=question.id)
+    items.update(given_grade=0, final_grade=0)
+
+    # Marking only resets the state of the items
+    key = question.answer_key_item('python')
+    assert key.mark_responses() == 5
+    assert set(items.values_list('status', flat=True)) == {'pending'}
+    assert set(items.values_list('final_grade', flat=True)) == {None}
+    assert set(items.values_list('given_grade', flat=True)) == {0}
+
+    call_command('regrade', activity=[question.id], workers=1, pending=True)
+    assert set(items.values_list('status', flat=True)) == {'done'}
+    assert set(items.values_list('final_grade', flat=True)) == {100}
+
+
+def test_marked_items_only_run_new_cases(question, graded_responses):
+    items = models.CodingIoResponseItem.objects\
+        .filter(response__activity_id=question.id)
+    key = question.answer_key_item('python')
+    key.mark_responses()
+
+    # All test cases passed before, hence nothing has to run again
+    item = items.first()
+    item.regrade_cases = None
+    assert item.regrade('update')
+    assert item.status == 'done' and item.final_grade == 100
+
+    # Outcomes from an older answer key make all test cases new
+    item = items.last()
+    item.feedback_data['outcomes'] = {'passed': ['0' * 16], 'failed': []}
+    item.given_grade = 0
+    assert item.regrade('update')
+    assert item.given_grade == item.final_grade == 100
+
+
+#
+# Regrade command
+#
+def write_regrade_checkpoint(path, question, last_id):
+    import json
+
+    state = {
+        'run': {'activities': [question.id], 'method': 'update',
+                'pending': False},
+        'last_id': last_id,
+        'processed': 2,
+        'updated': 0,
+    }
+    with open(path, 'w') as fd:
+        json.dump(state, fd)
+
+
+def test_regrade_command_resumes_from_checkpoint(question, graded_responses,
+                                                 tmpdir):
+    import os
+    from django.core.management import call_command
+
+    items = models.CodingIoResponseItem.objects\
+        .filter(response__activity_id=question.id)\
+        .order_by('id')
+    ids = list(items.values_list('id', flat=True))
+    items.update(given_grade=0, final_grade=0)
+    checkpoint = str(tmpdir.join('regrade.checkpoint'))
+    write_regrade_checkpoint(checkpoint, question, ids[1])
+
+    call_command('regrade', activity=[question.id], workers=1, chunk_size=2,
+                 checkpoint=checkpoint, resume=True)
+    grades = list(items.values_list('final_grade', flat=True))
+    assert grades == [0, 0, 100, 100, 100]
+    assert not os.path.exists(checkpoint)
+
+
+def test_regrade_command_rejects_checkpoint_of_other_run(question, tmpdir):
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+
+    checkpoint = str(tmpdir.join('regrade.checkpoint'))
+    write_regrade_checkpoint(checkpoint, question, 0)
+    with pytest.raises(CommandError):
+        call_command('regrade', activity=[question.id], method='best',
+                     workers=1, checkpoint=checkpoint, resume=True)
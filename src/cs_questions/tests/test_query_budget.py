@@ -0,0 +1,310 @@
+"""
+Query and time budgets for the views that students hit most often.
+
+A realistic course is seeded once per module: hundreds of students, dozens of
+questions and thousands of response items. Each view is requested once to warm
+up templates and then measured with an empty cache. A test fails if a view
+executes more queries or takes longer than its budget, which catches N+1
+regressions that are invisible with small fixtures.
+"""
+
+import json
+from types import SimpleNamespace
+from django.conf.urls import include, url
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from wagtail.wagtailcore.models import Site
+from codeschool.urls import urlpatterns as codeschool_urlpatterns
+from cs_core import models as core_models
+from cs_core.models import programming_language
+from cs_questions.tests import *
+from cs_battles.models import Battle, BattleResponse
+from cs_polls.models import Poll, Option, Vote
+
+# Battles and polls are not routed in the main url conf.
+urlpatterns = [
+    url(r'^battles/', include('cs_battles.urls')),
+    url(r'^polls/', include('cs_polls.urls')),
+] + codeschool_urlpatterns
+
+pytestmark = [pytest.mark.django_db, pytest.mark.urls(__name__)]
+
+# Size of the seeded course
+NUM_STUDENTS = 200
+NUM_QUESTIONS = 24
+QUESTIONS_PER_STUDENT = 5
+ITEMS_PER_RESPONSE = 2
+ITEMS_HEAVY_USER = 100
+NUM_BATTLES = 40
+NUM_POLL_OPTIONS = 5
+
+# Maximum number of queries and time (in seconds) for each view
+BUDGETS = {
+    'question_page': (50, 1.0),
+    'respond_route': (80, 5.0),
+    'gradebook': (20, 0.5),
+    'stats_route': (30, 0.5),
+    'response_list': (30, 1.0),
+    'battle_user': (20, 0.5),
+    'battle_detail': (40, 0.5),
+    'poll_detail': (20, 0.5),
+    'poll_result': (30, 0.5),
+}
+
+
+def seed_course():
+    """
+    Create a course with all students, questions, responses, battles and
+    polls used in the tests.
+    """
+
+    root = Site.objects.get(is_default_site=True).root_page
+    faculty = FacultyFactory.create(parent_page=root)
+    discipline = DisciplineFactory.create(faculty=faculty)
+    teacher = UserFactory.create(username='teacher')
+    course = CourseFactory.create(title='Seeded course',
+                                  discipline=discipline,
+                                  teachers=[teacher])
+    students = [UserFactory.create(username='student-%s' % i)
+                for i in range(NUM_STUDENTS)]
+    course.students.add(*students)
+
+    question_list = course.questions_page
+    questions = [
+        CodingIoQuestionFactory.create(title='Question %s' % i,
+                                       parent_page=question_list,
+                                       owner=teacher)
+        for i in range(NUM_QUESTIONS)
+    ]
+    seed_responses(students, questions)
+    return SimpleNamespace(
+        course=course,
+        teacher=teacher,
+        students=students,
+        question_list=question_list,
+        questions=questions,
+        battles=seed_battles(students, questions),
+        poll=seed_poll(students),
+    )
+
+
+def seed_responses(students, questions):
+    """
+    Create ITEMS_PER_RESPONSE response items for QUESTIONS_PER_STUDENT
+    questions of each student.
+
+    Only the first response to each question is graded. The remaining items are
+    bulk created copying its feedback.
+    """
+
+    source = CodingIoAnswerKeyFactory.source
+    python = programming_language('python')
+    item_class = models.CodingIoResponseItem
+    item_ctype = ContentType.objects.get_for_model(
+        item_class, for_concrete_model=False
+    )
+    response_ctype = ContentType.objects.get_for_model(
+        core_models.Response
+    )
+
+    # Grade one response per question
+    graded = {}
+    for question in questions:
+        item = question.register_response_item(
+            source, language=python, user=students[0], autograde=True
+        )
+        graded[question.id] = item
+
+    # Create all responses
+    pairs = {(students[0].id, question.id) for question in questions}
+    responses = []
+    for i, student in enumerate(students):
+        for k in range(QUESTIONS_PER_STUDENT):
+            question = questions[(i + 7 * k) % len(questions)]
+            if (student.id, question.id) in pairs:
+                continue
+            pairs.add((student.id, question.id))
+            responses.append(core_models.Response(
+                user=student,
+                activity=question,
+                context=graded[question.id].context,
+                polymorphic_ctype=response_ctype,
+            ))
+    core_models.Response.objects.bulk_create(responses)
+
+    # Create response items
+    question_ids = [question.id for question in questions]
+    responses = core_models.Response.objects\
+        .non_polymorphic()\
+        .filter(activity_id__in=question_ids)
+    items = []
+    for response in responses:
+        reference = graded[response.activity_id]
+        num_items = ITEMS_PER_RESPONSE
+        if response.user_id == students[0].id:
+            num_items = ITEMS_HEAVY_USER
+        for k in range(num_items):
+            response_data = dict(reference.response_data,
+                                 source='%s\n# %s' % (source, k))
+            items.append(item_class(
+                response=response,
+                response_data=response_data,
+                response_hash=item_class.get_response_hash(response_data),
+                feedback_data=reference.feedback_data,
+                status=item_class.STATUS_DONE,
+                given_grade=(k * 37) % 101,
+                final_grade=(k * 37) % 101,
+                polymorphic_ctype=item_ctype,
+            ))
+    item_class.objects.bulk_create(items)
+    core_models.Response.update_all(responses)
+
+
+def seed_battles(students, questions):
+    """
+    Create NUM_BATTLES battles between the first two students.
+    """
+
+    python = programming_language('python')
+    battles = []
+    for i in range(NUM_BATTLES):
+        question = questions[i % len(questions)]
+        battle = Battle.objects.create(battle_owner=students[0],
+                                       question=question,
+                                       language=python)
+        for k, user in enumerate(students[:2]):
+            now = timezone.now()
+            BattleResponse.objects.create(
+                user=user,
+                activity=question,
+                context=question.default_context,
+                response_data={'language': python.ref,
+                               'source': '#' * k},
+                time_begin=now,
+                time_end=now,
+                battle=battle,
+            )
+        battles.append(battle)
+    return battles
+
+
+def seed_poll(students):
+    """
+    Create a poll in which all students have voted.
+    """
+
+    poll = Poll.objects.create(name='Seeded poll',
+                               short_description='A poll')
+    options = [Option.objects.create(poll=poll, index=i, name='Option %s' % i)
+               for i in range(NUM_POLL_OPTIONS)]
+    Vote.objects.bulk_create(
+        Vote(poll=poll, user=student, option=options[i % len(options)])
+        for i, student in enumerate(students)
+    )
+    poll.voters.add(*students)
+    return poll
+
+
+@pytest.fixture(scope='module')
+def seed(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        with transaction.atomic():
+            yield seed_course()
+            transaction.set_rollback(True)
+
+
+def check_budget(name, func):
+    """
+    Call func() once to warm up and again within the budget for the given
+    view name. Return the response of the measured call.
+    """
+
+    func()
+    cache.clear()
+    max_queries, max_seconds = BUDGETS[name]
+    with query_budget(max_queries, max_seconds):
+        response = func()
+    assert response.status_code == 200
+    return response
+
+
+@pytest.fixture
+def student_client(client, seed):
+    client.force_login(seed.students[0])
+    return client
+
+
+@pytest.fixture
+def teacher_client(client, seed):
+    client.force_login(seed.teacher)
+    return client
+
+
+#
+# Questions
+#
+def test_question_page_budget(seed, student_client):
+    url = seed.questions[0].url
+    check_budget('question_page', lambda: student_client.get(url))
+
+
+def test_respond_route_budget(seed, student_client):
+    url = seed.questions[0].url + 'submit-response/'
+    source = CodingIoAnswerKeyFactory.source
+    sources = iter(['%s\n# submission %s' % (source, i) for i in range(2)])
+
+    def submit():
+        data = {'kwargs': {'source': next(sources), 'language': 'python'}}
+        return student_client.post(url, json.dumps(data),
+                                   content_type='application/json')
+
+    check_budget('respond_route', submit)
+
+
+def test_gradebook_budget(seed, student_client):
+    url = seed.question_list.url + 'grades/'
+    check_budget('gradebook', lambda: student_client.get(url))
+
+
+def test_gradebook_renders_grades(seed, student_client):
+    url = seed.question_list.url + 'grades/'
+    content = student_client.get(url).content.decode('utf8')
+    for question in seed.questions:
+        link = '<a href="%s">%s</a>' % (question.url, question.title)
+        assert link in content
+    row = '<td>%s</td><td>100.0%%</td>' % (1 + ITEMS_HEAVY_USER)
+    assert content.count(row) == NUM_QUESTIONS
+
+
+def test_stats_route_budget(seed, teacher_client):
+    url = seed.questions[0].url + 'stats/'
+    check_budget('stats_route', lambda: teacher_client.get(url))
+
+
+def test_response_list_budget(seed, student_client):
+    url = seed.questions[0].url + 'responses/'
+    check_budget('response_list', lambda: student_client.get(url))
+
+
+#
+# Battles and polls
+#
+def test_battle_user_budget(seed, student_client):
+    check_budget('battle_user', lambda: student_client.get('/battles/user'))
+
+
+def test_battle_detail_budget(seed, student_client):
+    url = '/battles/%s/' % seed.battles[0].pk
+    check_budget('battle_detail', lambda: student_client.get(url))
+
+
+def test_poll_detail_budget(seed, student_client):
+    url = '/polls/%s/' % seed.poll.pk
+    check_budget('poll_detail', lambda: student_client.get(url))
+
+
+def test_poll_result_budget(seed, student_client):
+    url = '/polls/%s/result/' % seed.poll.pk
+    check_budget('poll_result', lambda: student_client.get(url))
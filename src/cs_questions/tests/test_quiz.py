@@ -0,0 +1,79 @@
+from cs_questions.tests import *
+from cs_questions.tests.generic_testcases import *
+
+
+@pytest.fixture
+def course(db):
+    return CourseFactory.create(title='Course')
+
+
+@pytest.fixture
+def make_quiz(course):
+    def make_quiz(num_questions):
+        quiz_list = models.QuizList.objects.get(
+            depth=course.depth + 1,
+            path__startswith=course.path,
+            slug='quizzes',
+        )
+        quiz = quiz_list.add_child(instance=models.Quiz(title='Quiz'))
+        questions = [
+            CodingIoQuestionFactory.create(parent_page=course.questions_page)
+            for _ in range(num_questions)
+        ]
+        for question in questions:
+            quiz.quiz_items.create(question=question)
+        return quiz, questions
+    return make_quiz
+
+
+@pytest.fixture
+def answer(user, python, source_hello_py):
+    def answer(quiz_item, question, grade):
+        item = question.register_response_item(
+            source_hello_py, language=python, user=user, recycle=False
+        )
+        models.CodingIoResponseItem.objects\
+            .filter(pk=item.pk)\
+            .update(final_grade=grade)
+        quiz_item.register_response(item)
+        return item
+    return answer
+
+
+def test_quiz_grade_drops_the_lowest_question(
+        make_quiz, answer, user, django_assert_num_queries):
+    quiz, (q1, q2, q3) = make_quiz(3)
+    item = quiz.register_response_item(user=user)
+    answer(item, q1, 100)
+    answer(item, q1, 60)
+    answer(item, q2, 50)
+
+    # q3 is unanswered and counts as zero, so it is the dropped grade
+    with django_assert_num_queries(1):
+        assert item.autograde_compute() == 75
+
+    answer(item, q3, 20)
+    with django_assert_num_queries(1):
+        assert item.autograde_compute() == 75
+
+
+def test_quiz_grade_of_a_single_question(
+        make_quiz, answer, user, django_assert_num_queries):
+    quiz, (question,) = make_quiz(1)
+    item = quiz.register_response_item(user=user)
+    answer(item, question, 40)
+
+    with django_assert_num_queries(1):
+        assert item.autograde_compute() == 40
+
+
+def test_unanswered_quiz_has_zero_grade(
+        make_quiz, user, django_assert_num_queries):
+    quiz, questions = make_quiz(3)
+    item = quiz.register_response_item(user=user)
+    assert not item.is_answered()
+
+    with django_assert_num_queries(0):
+        grades = item.get_question_grades()
+    assert grades == {question.id: 0 for question in questions}
+    assert item.autograde_compute() == 0